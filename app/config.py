@@ -11,6 +11,7 @@ def load_config() -> AppConfig:
     settings_raw = raw.get("settings", {})
     settings = Settings(
         max_scan_files=settings_raw.get("max_scan_files", 200000),
+        scan_workers=int(settings_raw.get("scan_workers", 4)),
         video_exts=settings_raw.get("video_exts", [".mkv", ".mp4", ".avi", ".ts", ".m2ts"]),
     )
 
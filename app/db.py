@@ -1,18 +1,49 @@
 import os
+import json
 import sqlite3
-from typing import List, Dict, Any
+import threading
+from typing import List, Dict, Any, Iterator
 
 DB_PATH = os.getenv("APP_DB", "/data/app.db")
 
+# 每个线程复用一条连接；WAL 下读写互不阻塞，写锁冲突时等待 busy_timeout 而不是立刻报 locked
+_local = threading.local()
 
-def conn():
-    c = sqlite3.connect(DB_PATH)
+# app_settings 进程内缓存：首次读取时一条查询整表载入，set_setting 时失效
+_settings_cache = {"data": None}
+_settings_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    c = sqlite3.connect(DB_PATH, timeout=30)
     c.row_factory = sqlite3.Row
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA busy_timeout=30000")
+    c.execute("PRAGMA temp_store=MEMORY")
+    c.execute("PRAGMA cache_size=-16000")
+    c.execute("PRAGMA foreign_keys=ON")
     return c
 
 
+def conn():
+    c = getattr(_local, "conn", None)
+    if c is None or _local.path != DB_PATH:
+        c = _connect()
+        _local.conn = c
+        _local.path = DB_PATH
+    return c
+
+
+def _ensure_column(c, table: str, column: str, decl: str):
+    cols = {r["name"] for r in c.execute(f"PRAGMA table_info({table})").fetchall()}
+    if column not in cols:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
 def init_db():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    _settings_cache["data"] = None
     with conn() as c:
         c.execute(
             """
@@ -59,6 +90,156 @@ def init_db():
             )
             """
         )
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS media_dirs (
+              path TEXT PRIMARY KEY,
+              parent TEXT,
+              mtime_ns INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS media_files (
+              path TEXT PRIMARY KEY,
+              parent TEXT NOT NULL,
+              stem TEXT NOT NULL,
+              suffix TEXT NOT NULL,
+              size INTEGER NOT NULL DEFAULT 0,
+              mtime REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+        c.execute("CREATE INDEX IF NOT EXISTS idx_media_dirs_parent ON media_dirs(parent)")
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS source_cache (
+              kind TEXT NOT NULL,
+              params TEXT NOT NULL,
+              titles TEXT NOT NULL,
+              fetched_at REAL NOT NULL,
+              PRIMARY KEY(kind, params)
+            )
+            """
+        )
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rule_fingerprints (
+              rule_id INTEGER PRIMARY KEY,
+              fingerprint TEXT NOT NULL,
+              result TEXT,
+              updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS match_cache (
+              candidate TEXT PRIMARY KEY,
+              scope TEXT NOT NULL,
+              generation INTEGER NOT NULL,
+              paths TEXT NOT NULL,
+              used_at REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS media_index_changes (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              generation INTEGER NOT NULL,
+              stem TEXT NOT NULL
+            )
+            """
+        )
+        c.execute("CREATE INDEX IF NOT EXISTS idx_media_index_changes_gen ON media_index_changes(generation)")
+        # RSS 条件请求：上次响应的 ETag / Last-Modified 以及对应的标题列表
+        _ensure_column(c, "sources", "http_etag", "TEXT DEFAULT ''")
+        _ensure_column(c, "sources", "http_last_modified", "TEXT DEFAULT ''")
+        _ensure_column(c, "sources", "cached_titles", "TEXT")
+        # 规则上次真正匹配/确认时的媒体索引代号，配合 media_index_changes 判断规则是否受文件变动影响
+        _ensure_column(c, "rule_fingerprints", "generation", "INTEGER DEFAULT 0")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_media_files_parent ON media_files(parent)")
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rule_sources (
+              rule_id INTEGER NOT NULL REFERENCES rules(id) ON DELETE CASCADE,
+              source_id INTEGER NOT NULL REFERENCES sources(id) ON DELETE CASCADE,
+              position INTEGER NOT NULL DEFAULT 0,
+              PRIMARY KEY(rule_id, source_id)
+            )
+            """
+        )
+        c.execute("CREATE INDEX IF NOT EXISTS idx_rule_sources_source ON rule_sources(source_id)")
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              run_key TEXT NOT NULL,
+              trigger TEXT NOT NULL DEFAULT '',
+              status TEXT NOT NULL DEFAULT 'running',
+              started_at TEXT DEFAULT CURRENT_TIMESTAMP,
+              finished_at TEXT,
+              elapsed_ms INTEGER NOT NULL DEFAULT 0,
+              rules_total INTEGER NOT NULL DEFAULT 0,
+              rules_skipped INTEGER NOT NULL DEFAULT 0,
+              linked INTEGER NOT NULL DEFAULT 0,
+              errors INTEGER NOT NULL DEFAULT 0,
+              files_added INTEGER NOT NULL DEFAULT 0,
+              files_removed INTEGER NOT NULL DEFAULT 0,
+              error TEXT DEFAULT ''
+            )
+            """
+        )
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS run_rule_results (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+              rule_id INTEGER,
+              rule_name TEXT NOT NULL,
+              target TEXT,
+              linked INTEGER NOT NULL DEFAULT 0,
+              added INTEGER NOT NULL DEFAULT 0,
+              removed INTEGER NOT NULL DEFAULT 0,
+              kept INTEGER NOT NULL DEFAULT 0,
+              updated INTEGER NOT NULL DEFAULT 0,
+              errors INTEGER NOT NULL DEFAULT 0,
+              skipped INTEGER NOT NULL DEFAULT 0,
+              elapsed_ms INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        _ensure_column(c, "runs", "metrics", "TEXT")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_runs_started_at ON runs(started_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_run_rule_results_run ON run_rule_results(run_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_run_rule_results_rule ON run_rule_results(rule_id, run_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_run_logs_run_at ON run_logs(run_at)")
+        if c.execute("PRAGMA user_version").fetchone()[0] < 1:
+            # 旧版本把来源写在 rules.source_ids（逗号分隔）里：迁移到 rule_sources，已不存在的来源 ID 直接丢弃
+            for r in c.execute("SELECT id, source_ids FROM rules").fetchall():
+                _set_rule_sources(c, r["id"], r["source_ids"])
+            c.execute("PRAGMA user_version=1")
+
+
+def _parse_source_ids(csv_text: str) -> List[int]:
+    out = []
+    for x in (csv_text or "").split(","):
+        try:
+            out.append(int(x.strip()))
+        except ValueError:
+            pass
+    return out
+
+
+def _set_rule_sources(c, rule_id: int, source_ids: str):
+    c.execute("DELETE FROM rule_sources WHERE rule_id=?", (rule_id,))
+    for pos, sid in enumerate(_parse_source_ids(source_ids)):
+        c.execute(
+            "INSERT OR IGNORE INTO rule_sources(rule_id, source_id, position) SELECT ?, id, ? FROM sources WHERE id=?",
+            (rule_id, pos, sid),
+        )
 
 
 def list_sources() -> List[Dict[str, Any]]:
@@ -88,23 +269,89 @@ def delete_source(source_id: int):
 def update_source(source_id: int, name: str, kind: str, rss_url: str, platform: str):
     with conn() as c:
         c.execute(
-            "UPDATE sources SET name=?, kind=?, rss_url=?, platform=? WHERE id=?",
+            "UPDATE sources SET name=?, kind=?, rss_url=?, platform=?, http_etag='', http_last_modified='', cached_titles=NULL WHERE id=?",
             (name.strip(), kind.strip() or "rss", (rss_url or "").strip(), (platform or "").strip(), source_id),
         )
 
 
+def save_source_feed_cache(source_id: int, etag: str, last_modified: str, titles_json: str):
+    with conn() as c:
+        c.execute(
+            "UPDATE sources SET http_etag=?, http_last_modified=?, cached_titles=? WHERE id=?",
+            (etag or "", last_modified or "", titles_json, source_id),
+        )
+
+
+def get_source_cache(kind: str, params: str) -> Dict[str, Any] | None:
+    with conn() as c:
+        row = c.execute("SELECT titles, fetched_at FROM source_cache WHERE kind=? AND params=?", (kind, params)).fetchone()
+    return dict(row) if row else None
+
+
+def put_source_cache(kind: str, params: str, titles_json: str, fetched_at: float):
+    with conn() as c:
+        c.execute(
+            "INSERT INTO source_cache(kind, params, titles, fetched_at) VALUES(?,?,?,?) ON CONFLICT(kind, params) DO UPDATE SET titles=excluded.titles, fetched_at=excluded.fetched_at",
+            (kind, params, titles_json, fetched_at),
+        )
+
+
+def get_rule_fingerprint(rule_id: int) -> Dict[str, Any] | None:
+    with conn() as c:
+        row = c.execute("SELECT fingerprint, result, generation FROM rule_fingerprints WHERE rule_id=?", (rule_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def save_rule_fingerprint(rule_id: int, fingerprint: str, result_json: str, generation: int):
+    with conn() as c:
+        c.execute(
+            "INSERT INTO rule_fingerprints(rule_id, fingerprint, result, generation, updated_at) VALUES(?,?,?,?,CURRENT_TIMESTAMP) "
+            "ON CONFLICT(rule_id) DO UPDATE SET fingerprint=excluded.fingerprint, result=excluded.result, "
+            "generation=excluded.generation, updated_at=excluded.updated_at",
+            (rule_id, fingerprint, result_json, generation),
+        )
+
+
+def oldest_rule_generation() -> int | None:
+    # 启用中的规则里最旧的代号；更早的变更日志没有规则再需要
+    with conn() as c:
+        row = c.execute(
+            "SELECT MIN(f.generation) FROM rule_fingerprints f JOIN rules r ON r.id=f.rule_id WHERE r.enabled=1"
+        ).fetchone()
+    return row[0]
+
+
+def load_rule_sources() -> Dict[int, List[int]]:
+    # 一条查询取出整张 规则 -> 来源 关系图，按规则内配置顺序排列
+    with conn() as c:
+        rows = c.execute("SELECT rule_id, source_id FROM rule_sources ORDER BY rule_id, position").fetchall()
+    out: Dict[int, List[int]] = {}
+    for r in rows:
+        out.setdefault(r["rule_id"], []).append(r["source_id"])
+    return out
+
+
 def list_rules() -> List[Dict[str, Any]]:
     with conn() as c:
         rows = c.execute("SELECT * FROM rules ORDER BY id DESC").fetchall()
-    return [dict(r) for r in rows]
+    graph = load_rule_sources()
+    out = []
+    for r in rows:
+        x = dict(r)
+        # source_ids 仍以逗号分隔字符串提供给模板，内容以 rule_sources 为准
+        x["source_id_list"] = graph.get(x["id"], [])
+        x["source_ids"] = ",".join(str(i) for i in x["source_id_list"])
+        out.append(x)
+    return out
 
 
 def create_rule(name: str, target_subdir: str, source_ids: str, include_keywords: str, exclude_keywords: str, max_items: int):
     with conn() as c:
-        c.execute(
+        cur = c.execute(
             "INSERT INTO rules(name, target_subdir, source_ids, include_keywords, exclude_keywords, max_items, enabled) VALUES(?,?,?,?,?,?,1)",
             (name.strip(), target_subdir.strip(), source_ids.strip(), include_keywords.strip(), exclude_keywords.strip(), max(1, int(max_items))),
         )
+        _set_rule_sources(c, cur.lastrowid, source_ids)
 
 
 def toggle_rule(rule_id: int):
@@ -115,6 +362,7 @@ def toggle_rule(rule_id: int):
 def delete_rule(rule_id: int):
     with conn() as c:
         c.execute("DELETE FROM rules WHERE id=?", (rule_id,))
+        c.execute("DELETE FROM rule_fingerprints WHERE rule_id=?", (rule_id,))
 
 
 def update_rule(rule_id: int, name: str, target_subdir: str, source_ids: str, include_keywords: str, exclude_keywords: str, max_items: int):
@@ -123,17 +371,31 @@ def update_rule(rule_id: int, name: str, target_subdir: str, source_ids: str, in
             "UPDATE rules SET name=?, target_subdir=?, source_ids=?, include_keywords=?, exclude_keywords=?, max_items=? WHERE id=?",
             (name.strip(), target_subdir.strip(), source_ids.strip(), include_keywords.strip(), exclude_keywords.strip(), max(1, int(max_items)), rule_id),
         )
+        _set_rule_sources(c, rule_id, source_ids)
+
+
+def _settings() -> Dict[str, str]:
+    data = _settings_cache["data"]
+    if data is None:
+        with _settings_lock:
+            data = _settings_cache["data"]
+            if data is None:
+                with conn() as c:
+                    data = {r["k"]: r["v"] for r in c.execute("SELECT k, v FROM app_settings")}
+                _settings_cache["data"] = data
+    return data
 
 
 def get_setting(key: str, default: str = "") -> str:
-    with conn() as c:
-        row = c.execute("SELECT v FROM app_settings WHERE k=?", (key,)).fetchone()
-    return row["v"] if row else default
+    data = _settings()
+    return data[key] if key in data else default
 
 
 def set_setting(key: str, value: str):
-    with conn() as c:
-        c.execute("INSERT INTO app_settings(k, v) VALUES(?, ?) ON CONFLICT(k) DO UPDATE SET v=excluded.v", (key, value))
+    with _settings_lock:
+        with conn() as c:
+            c.execute("INSERT INTO app_settings(k, v) VALUES(?, ?) ON CONFLICT(k) DO UPDATE SET v=excluded.v", (key, value))
+        _settings_cache["data"] = None
 
 
 def append_run_log(summary: str):
@@ -141,7 +403,206 @@ def append_run_log(summary: str):
         c.execute("INSERT INTO run_logs(summary) VALUES(?)", (summary,))
 
 
-def list_run_logs(limit: int = 20):
+def list_run_logs(limit: int = 20, before: int | None = None):
+    # 按 id 倒序的 keyset 分页：before 为上一页最后一条的 id
     with conn() as c:
-        rows = c.execute("SELECT * FROM run_logs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        if before:
+            rows = c.execute("SELECT * FROM run_logs WHERE id<? ORDER BY id DESC LIMIT ?", (before, limit)).fetchall()
+        else:
+            rows = c.execute("SELECT * FROM run_logs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
     return [dict(r) for r in rows]
+
+
+def create_run(run_key: str, trigger: str) -> int:
+    with conn() as c:
+        return c.execute("INSERT INTO runs(run_key, trigger) VALUES(?,?)", (run_key, trigger)).lastrowid
+
+
+def finish_run(
+    run_id: int,
+    status: str,
+    elapsed_ms: int,
+    results: List[Dict[str, Any]],
+    stats: Dict[str, Any] | None = None,
+    error: str = "",
+    metrics: Dict[str, Any] | None = None,
+):
+    stats = stats or {}
+    with conn() as c:
+        c.execute(
+            "UPDATE runs SET status=?, finished_at=CURRENT_TIMESTAMP, elapsed_ms=?, rules_total=?, rules_skipped=?, linked=?, errors=?, "
+            "files_added=?, files_removed=?, error=?, metrics=? WHERE id=?",
+            (
+                status,
+                elapsed_ms,
+                len(results),
+                sum(1 for r in results if r.get("skipped")),
+                sum(r.get("linked", 0) for r in results),
+                sum(r.get("errors", 0) for r in results),
+                stats.get("files_added", 0),
+                stats.get("files_removed", 0),
+                error[:1000],
+                json.dumps(metrics) if metrics else None,
+                run_id,
+            ),
+        )
+        c.executemany(
+            "INSERT INTO run_rule_results(run_id, rule_id, rule_name, target, linked, added, removed, kept, updated, errors, skipped, elapsed_ms) "
+            "VALUES(?,?,?,?,?,?,?,?,?,?,?,?)",
+            [
+                (
+                    run_id, r.get("rule_id"), r.get("rule", ""), r.get("target", ""), r.get("linked", 0), r.get("added", 0), r.get("removed", 0),
+                    r.get("kept", 0), r.get("updated", 0), r.get("errors", 0), 1 if r.get("skipped") else 0, r.get("elapsed_ms", 0),
+                )
+                for r in results
+            ],
+        )
+
+
+def list_runs(limit: int = 20, before: int | None = None) -> List[Dict[str, Any]]:
+    with conn() as c:
+        if before:
+            rows = c.execute("SELECT * FROM runs WHERE id<? ORDER BY id DESC LIMIT ?", (before, limit)).fetchall()
+        else:
+            rows = c.execute("SELECT * FROM runs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return [dict(r) for r in rows]
+
+
+def last_finished_run() -> Dict[str, Any] | None:
+    with conn() as c:
+        row = c.execute("SELECT * FROM runs WHERE status!='running' ORDER BY id DESC LIMIT 1").fetchone()
+        if not row:
+            return None
+        results = c.execute("SELECT * FROM run_rule_results WHERE run_id=? ORDER BY id", (row["id"],)).fetchall()
+    out = dict(row)
+    out["results"] = [dict(r) for r in results]
+    return out
+
+
+def latest_rule_results() -> Dict[int, Dict[str, Any]]:
+    with conn() as c:
+        rows = c.execute(
+            "SELECT * FROM run_rule_results WHERE id IN (SELECT MAX(id) FROM run_rule_results WHERE rule_id IS NOT NULL GROUP BY rule_id)"
+        ).fetchall()
+    return {r["rule_id"]: dict(r) for r in rows}
+
+
+def prune_history(days: int, batch: int = 500) -> int:
+    # 按批删除，每批一个短事务，避免一次大删除长时间占着写锁
+    cutoff = f"-{max(1, int(days))} days"
+    total = 0
+    for sql in (
+        "DELETE FROM runs WHERE id IN (SELECT id FROM runs WHERE started_at < datetime('now', ?) AND status!='running' ORDER BY id LIMIT ?)",
+        "DELETE FROM run_logs WHERE id IN (SELECT id FROM run_logs WHERE run_at < datetime('now', ?) ORDER BY id LIMIT ?)",
+    ):
+        while True:
+            with conn() as c:
+                n = c.execute(sql, (cutoff, batch)).rowcount
+            total += n
+            if n < batch:
+                break
+    return total
+
+
+def load_media_dirs() -> Dict[str, Dict[str, Any]]:
+    with conn() as c:
+        rows = c.execute(
+            "SELECT d.path, d.parent, d.mtime_ns, COUNT(f.path) AS files FROM media_dirs d "
+            "LEFT JOIN media_files f ON f.parent=d.path GROUP BY d.path"
+        ).fetchall()
+    return {r["path"]: dict(r) for r in rows}
+
+
+def save_media_index_changes(changed: Dict[str, Dict[str, Any]], removed: List[str]) -> Dict[str, List[tuple]]:
+    # changed: dir -> {"parent", "mtime_ns", "files": [(path, stem, suffix, size, mtime)]}
+    # 返回真正增删的文件 (path, stem)，目录 mtime 变了但文件没变时两者都为空
+    diff = {"added": [], "removed": []}
+    with conn() as c:
+        for d in removed:
+            diff["removed"].extend(tuple(r) for r in c.execute("SELECT path, stem FROM media_files WHERE parent=?", (d,)))
+            c.execute("DELETE FROM media_dirs WHERE path=?", (d,))
+            c.execute("DELETE FROM media_files WHERE parent=?", (d,))
+        for d, x in changed.items():
+            old = {r["path"]: r["stem"] for r in c.execute("SELECT path, stem FROM media_files WHERE parent=?", (d,))}
+            new = {p: stem for p, stem, _, _, _ in x["files"]}
+            diff["removed"].extend((p, stem) for p, stem in old.items() if p not in new)
+            diff["added"].extend((p, stem) for p, stem in new.items() if p not in old)
+            c.execute(
+                "INSERT INTO media_dirs(path, parent, mtime_ns) VALUES(?,?,?) ON CONFLICT(path) DO UPDATE SET parent=excluded.parent, mtime_ns=excluded.mtime_ns",
+                (d, x["parent"], x["mtime_ns"]),
+            )
+            c.execute("DELETE FROM media_files WHERE parent=?", (d,))
+            c.executemany(
+                "INSERT OR REPLACE INTO media_files(path, parent, stem, suffix, size, mtime) VALUES(?,?,?,?,?,?)",
+                [(p, d, stem, suffix, size, mtime) for p, stem, suffix, size, mtime in x["files"]],
+            )
+    return diff
+
+
+def clear_media_index():
+    with conn() as c:
+        c.execute("DELETE FROM media_dirs")
+        c.execute("DELETE FROM media_files")
+        c.execute("DELETE FROM match_cache")
+        c.execute("DELETE FROM media_index_changes")
+
+
+def log_media_index_changes(generation: int, stems: List[str]):
+    with conn() as c:
+        c.executemany("INSERT INTO media_index_changes(generation, stem) VALUES(?,?)", [(generation, s) for s in stems])
+
+
+def list_media_index_changes(after_generation: int) -> List[Dict[str, Any]]:
+    with conn() as c:
+        rows = c.execute("SELECT generation, stem FROM media_index_changes WHERE generation>?", (after_generation,)).fetchall()
+    return [dict(r) for r in rows]
+
+
+def load_match_cache() -> List[Dict[str, Any]]:
+    with conn() as c:
+        rows = c.execute("SELECT candidate, scope, generation, paths FROM match_cache").fetchall()
+    return [dict(r) for r in rows]
+
+
+def clear_match_cache():
+    with conn() as c:
+        c.execute("DELETE FROM match_cache")
+        c.execute("DELETE FROM media_index_changes")
+
+
+def revalidate_match_cache(generation: int, dropped: List[tuple], kept: List[tuple], prune_to: int):
+    # dropped / kept: (candidate, 读到时的代号)。受影响的条目删除，校验过的条目推进到当前代号；
+    # 都按读到时的代号匹配，期间被别人改写的行不动。prune_to 及更早的变更日志不再需要
+    with conn() as c:
+        c.executemany("DELETE FROM match_cache WHERE candidate=? AND generation=?", dropped)
+        c.executemany("UPDATE match_cache SET generation=? WHERE candidate=? AND generation=?", [(generation, *x) for x in kept])
+        c.execute("DELETE FROM media_index_changes WHERE generation<=?", (prune_to,))
+
+
+def save_match_cache(entries: List[tuple], used: List[str], used_at: float, expire_before: float):
+    # entries: (candidate, scope, generation, paths_json)
+    with conn() as c:
+        c.executemany(
+            # 已有更新代号的条目时不覆盖：并发的旧读取方（如预览）不能把旧结果写回去
+            "INSERT INTO match_cache(candidate, scope, generation, paths, used_at) VALUES(?,?,?,?,?) "
+            "ON CONFLICT(candidate) DO UPDATE SET scope=excluded.scope, generation=excluded.generation, "
+            "paths=excluded.paths, used_at=excluded.used_at WHERE excluded.generation>=match_cache.generation",
+            [(*e, used_at) for e in entries],
+        )
+        c.executemany("UPDATE match_cache SET used_at=? WHERE candidate=?", [(used_at, x) for x in used])
+        c.execute("DELETE FROM match_cache WHERE used_at<?", (expire_before,))
+
+
+def iter_media_files(limit: int, local_first: bool = False) -> Iterator[tuple]:
+    # 逐行产出 (path, stem)，不把整张表一次性读成 dict 列表
+    sql = "SELECT path, stem FROM media_files ORDER BY path LIMIT ?"
+    if local_first:
+        # 先按路径截断到 limit，再把 .strm 排到本地文件之后
+        sql = "SELECT path, stem FROM (SELECT path, stem, suffix FROM media_files ORDER BY path LIMIT ?) ORDER BY suffix='.strm', path"
+    # 边遍历边产出，用独立连接，不占用本线程的复用连接
+    c = _connect()
+    try:
+        for r in c.execute(sql, (limit,)):
+            yield r["path"], r["stem"]
+    finally:
+        c.close()
@@ -1,4 +1,7 @@
-import requests
+import threading
+import time
+from typing import List, Callable
+from . import httpclient
 
 
 def refresh_emby(server_url: str, api_key: str, timeout: int = 15):
@@ -8,7 +11,150 @@ def refresh_emby(server_url: str, api_key: str, timeout: int = 15):
     base = server_url.rstrip("/")
     url = f"{base}/emby/Library/Refresh"
     try:
-        r = requests.post(url, params={"api_key": api_key}, timeout=timeout)
+        r = httpclient.post(url, params={"api_key": api_key}, timeout=timeout)
         return {"ok": r.ok, "status": r.status_code, "text": r.text[:200]}
     except Exception as e:
         return {"ok": False, "error": str(e)}
+
+
+def notify_emby_paths(server_url: str, api_key: str, paths: List[str], timeout: int = 15):
+    # 只通知发生变化的目录，Emby 只扫描这些路径，不会触发全库扫描
+    if not server_url or not api_key:
+        return {"ok": False, "error": "missing server_url/api_key"}
+    if not paths:
+        return {"ok": True, "skipped": True, "paths": []}
+
+    base = server_url.rstrip("/")
+    url = f"{base}/emby/Library/Media/Updated"
+    body = {"Updates": [{"Path": p, "UpdateType": "Modified"} for p in paths]}
+    try:
+        r = httpclient.post(url, params={"api_key": api_key}, json=body, timeout=timeout)
+        return {"ok": r.ok, "status": r.status_code, "paths": paths, "text": r.text[:200]}
+    except Exception as e:
+        return {"ok": False, "error": str(e), "paths": paths}
+
+
+def scan_task_state(server_url: str, api_key: str, timeout: int = 15) -> str | None:
+    base = server_url.rstrip("/")
+    r = httpclient.get(f"{base}/emby/ScheduledTasks", params={"api_key": api_key}, timeout=timeout)
+    if not r.ok:
+        return None
+    for t in r.json():
+        if t.get("Key") == "RefreshLibrary":
+            return t.get("State")
+    return None
+
+
+def wait_for_scan(server_url: str, api_key: str, interval: float = 10, timeout: float = 3600, idle_grace: int = 3) -> dict:
+    # 轮询“扫描媒体库”计划任务：见过 Running 后回到 Idle 即视为完成；
+    # 定向通知不一定触发该任务，连续 idle_grace 次 Idle 也视为完成
+    deadline = time.monotonic() + timeout
+    seen_running = False
+    idle = 0
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        try:
+            st = scan_task_state(server_url, api_key)
+        except Exception as e:
+            return {"completed": False, "error": str(e)}
+        if st is None:
+            return {"completed": False, "error": "RefreshLibrary task not found"}
+        if st == "Running":
+            seen_running = True
+            continue
+        idle += 1
+        if seen_running or idle >= idle_grace:
+            return {"completed": True, "scan_ran": seen_running}
+    return {"completed": False, "error": "timeout"}
+
+
+class RefreshCoordinator:
+    # 合并 debounce 窗口内的刷新请求（定向路径取并集，任一全量请求即全量），
+    # 同一时间只允许一轮刷新 + 完成轮询在进行；进行中收到的请求先攒着，本轮结束后合并再发一次
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timer = None
+        self._busy = False
+        self._full = False
+        self._paths = set()
+        self._deferred = False
+        self._conf = {}
+        self.on_done: Callable[[dict], None] | None = None
+
+    def busy(self) -> bool:
+        with self._lock:
+            return self._busy
+
+    def request(self, server_url: str, api_key: str, paths: List[str] | None = None, debounce: float = 30, poll_interval: float = 10, poll_timeout: float = 3600) -> dict:
+        if not server_url or not api_key:
+            return {"ok": False, "error": "missing server_url/api_key"}
+        with self._lock:
+            if paths is None:
+                self._full = True
+            else:
+                self._paths.update(paths)
+            self._conf = {
+                "server_url": server_url, "api_key": api_key, "debounce": debounce,
+                "poll_interval": poll_interval, "poll_timeout": poll_timeout,
+            }
+            if self._busy:
+                self._deferred = True
+            else:
+                self._schedule_locked(debounce)
+            return {"ok": True, "queued": True, "deferred": self._busy, "full": self._full, "paths": sorted(self._paths), "debounce": debounce}
+
+    def _schedule_locked(self, delay: float):
+        if self._timer is None:
+            self._timer = threading.Timer(max(0, delay), self._fire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _fire(self):
+        with self._lock:
+            self._timer = None
+            full, paths, conf = self._full, sorted(self._paths), dict(self._conf)
+            self._full = False
+            self._paths = set()
+            self._busy = True
+            self._deferred = False
+
+        start = time.monotonic()
+        resp = None
+        try:
+            try:
+                running = scan_task_state(conf["server_url"], conf["api_key"]) == "Running"
+            except Exception:
+                running = False
+            if running:
+                # Emby 已经在扫描：等它结束再发，不叠加第二轮扫描，也不丢这次的路径
+                waited = wait_for_scan(conf["server_url"], conf["api_key"], conf["poll_interval"], conf["poll_timeout"])
+                if not waited.get("completed"):
+                    resp = {"ok": False, "error": f"waiting for running emby scan: {waited.get('error')}"}
+            if resp is None:
+                resp = refresh_emby(conf["server_url"], conf["api_key"]) if full else notify_emby_paths(conf["server_url"], conf["api_key"], paths)
+                resp["waited_for_running_scan"] = running
+            if resp.get("ok") and not resp.get("skipped"):
+                resp.update(wait_for_scan(conf["server_url"], conf["api_key"], conf["poll_interval"], conf["poll_timeout"]))
+            resp["full"] = full
+            resp["duration_s"] = round(time.monotonic() - start, 1)
+        except Exception as e:
+            resp = {"ok": False, "error": str(e), "duration_s": round(time.monotonic() - start, 1)}
+        finally:
+            with self._lock:
+                self._busy = False
+                if resp is None or not resp.get("ok"):
+                    # 没发出去的变更留到下一次请求一起发，不在这里自动重试，Emby 挂掉时不会空转
+                    self._full = self._full or full
+                    self._paths.update(paths)
+                if self._deferred:
+                    self._deferred = False
+                    self._schedule_locked(conf.get("debounce", 30))
+
+        if self.on_done:
+            try:
+                self.on_done(resp)
+            except Exception:
+                pass
+
+
+refresh_coordinator = RefreshCoordinator()
@@ -1,32 +1,222 @@
 import os
 import shutil
+import time
 from pathlib import Path
 from typing import List
 from .models import MediaFile, Rule
 
+GENERATIONS_DIR = ".generations"
+# 原子模式下除当前代外额外保留的旧代数，给正在读取旧路径的扫描留出余量
+KEEP_OLD_GENERATIONS = 1
 
-def rebuild_rule_dir(virtual_root: str, rule: Rule, files: List[MediaFile]) -> dict:
-    target = Path(virtual_root) / rule.target_subdir
-    if target.exists():
+
+def _desired_links(files: List[MediaFile]):
+    # 使用“剧名/文件名”结构，Emby 更稳定；同名冲突时保留先出现的文件
+    desired = {}
+    dup = 0
+    for mf in files:
+        rel = os.path.join(mf.parent_name, mf.name)
+        if rel in desired:
+            dup += 1
+            continue
+        desired[rel] = mf.fspath
+    return desired, dup
+
+
+def _desired_dir_links(dirs: List[str | MediaFile]):
+    # 目录粒度：每部剧一个目录软链接，直接以剧集目录名挂在规则目录下；
+    # 找不到剧集目录的命中是文件（MediaFile 或 MediaLibrary 的视图），按“剧名/文件名”单文件链接，两者同名时保留先出现的
+    desired = {}
+    parents = set()
+    dup = 0
+    for d in dirs:
+        if not isinstance(d, str):
+            rel = os.path.join(d.parent_name, d.name)
+            if rel in desired or d.parent_name in desired:
+                dup += 1
+                continue
+            desired[rel] = d.fspath
+            parents.add(d.parent_name)
+            continue
+        name = os.path.basename(d)
+        if name in desired or name in parents:
+            dup += 1
+            continue
+        desired[name] = d
+    return desired, dup
+
+
+def _read_tree(target: Path):
+    # 同时识别两种布局：顶层目录软链接（目录粒度）和“剧名/文件名”文件软链接
+    links = {}
+    extras = []
+    if not target.is_dir():
+        return links, extras
+    with os.scandir(target) as top:
+        entries = list(top)
+    for d in entries:
+        if d.is_symlink():
+            links[d.name] = os.readlink(d.path)
+            continue
+        if not d.is_dir(follow_symlinks=False):
+            extras.append(d.path)
+            continue
+        with os.scandir(d.path) as it:
+            for e in it:
+                rel = os.path.join(d.name, e.name)
+                if e.is_symlink():
+                    links[rel] = os.readlink(e.path)
+                else:
+                    extras.append(e.path)
+    return links, extras
+
+
+def _remove(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.unlink(path)
+
+
+def _link(target: Path, rel: str, src: str):
+    dst = target / rel
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    os.symlink(src, dst)
+
+
+def _rebuild(target: Path, desired: dict, existing: dict) -> dict:
+    if target.is_symlink():
+        os.unlink(target)
+    elif target.exists():
         shutil.rmtree(target)
     target.mkdir(parents=True, exist_ok=True)
 
-    linked = 0
-    errors = 0
-    for mf in files:
+    counts = {"added": 0, "removed": 0, "kept": 0, "updated": 0, "errors": 0}
+    for rel, src in desired.items():
+        try:
+            _link(target, rel, src)
+        except Exception:
+            counts["errors"] += 1
+            continue
+        old = existing.get(rel)
+        if old is None:
+            counts["added"] += 1
+        elif old == src:
+            counts["kept"] += 1
+        else:
+            counts["updated"] += 1
+    counts["removed"] = sum(1 for rel in existing if rel not in desired)
+    return counts
+
+
+def _reconcile(target: Path, desired: dict, existing: dict, extras: List[str]) -> dict:
+    target.mkdir(parents=True, exist_ok=True)
+    counts = {"added": 0, "removed": 0, "kept": 0, "updated": 0, "errors": 0}
+
+    for path in extras:
         try:
-            # 使用“剧名/文件名”结构，Emby 更稳定
-            series_dir = target / mf.path.parent.name
-            series_dir.mkdir(parents=True, exist_ok=True)
-            dst = series_dir / mf.path.name
-            os.symlink(mf.path, dst)
-            linked += 1
+            _remove(path)
         except Exception:
-            errors += 1
+            counts["errors"] += 1
+
+    for rel, old in existing.items():
+        src = desired.get(rel)
+        if src == old:
+            counts["kept"] += 1
+            continue
+        try:
+            os.unlink(target / rel)
+        except Exception:
+            counts["errors"] += 1
+            continue
+        if src is None:
+            counts["removed"] += 1
+
+    # 先清掉空目录，切换粒度时同名的目录软链接才能建在原位置
+    with os.scandir(target) as it:
+        dirs = [d.path for d in it if d.is_dir(follow_symlinks=False)]
+    for d in dirs:
+        try:
+            os.rmdir(d)
+        except OSError:
+            pass
+
+    for rel, src in desired.items():
+        old = existing.get(rel)
+        if old == src:
+            continue
+        try:
+            _link(target, rel, src)
+        except Exception:
+            counts["errors"] += 1
+            continue
+        counts["added" if old is None else "updated"] += 1
+    return counts
+
+
+def _gc_generations(gens: Path, prefix: str, current: str | None):
+    if not gens.is_dir():
+        return
+    with os.scandir(gens) as it:
+        old = sorted(
+            e.name for e in it
+            if e.name.startswith(prefix) and e.name[len(prefix):].isdigit() and e.name != current
+        )
+    # 生成目录名带纳秒时间戳（定长），按名称排序即按时间排序
+    for name in old[:max(0, len(old) - KEEP_OLD_GENERATIONS)]:
+        shutil.rmtree(gens / name, ignore_errors=True)
+
+
+def _atomic_swap(virtual_root: str, target: Path, desired: dict, existing: dict, extras: List[str]) -> dict:
+    gens = Path(virtual_root) / GENERATIONS_DIR
+    prefix = str(target.relative_to(virtual_root)).replace(os.sep, "__") + "@"
+    current = os.path.basename(os.readlink(target)) if target.is_symlink() else None
+
+    if existing == desired and not extras and current:
+        _gc_generations(gens, prefix, current)
+        return {"added": 0, "removed": 0, "kept": len(desired), "updated": 0, "errors": 0}
+
+    # 新一代先在 .generations 下完整建好，再用 rename 覆盖软链接一次性切换；
+    # 中途崩溃时旧链接仍指向上一代，未完成的目录由下次 GC 清理
+    gens.mkdir(parents=True, exist_ok=True)
+    gen = gens / f"{prefix}{time.time_ns()}"
+    counts = _rebuild(gen, desired, existing)
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if target.exists() and not target.is_symlink():
+        # 从普通目录迁移到原子模式：旧目录先挪进 .generations，随后按旧代回收
+        os.rename(target, gens / f"{prefix}{0:019d}")
+    swap = target.parent / f".{target.name}.swap"
+    if swap.is_symlink() or swap.exists():
+        os.unlink(swap)
+    os.symlink(os.path.relpath(gen, target.parent), swap)
+    os.replace(swap, target)
+
+    _gc_generations(gens, prefix, gen.name)
+    return counts
+
+
+def rebuild_rule_dir(virtual_root: str, rule: Rule, files: List[MediaFile], mode: str = "reconcile", dirs: List[str | MediaFile] | None = None) -> dict:
+    target = Path(virtual_root) / rule.target_subdir
+    desired, dup = _desired_dir_links(dirs) if dirs is not None else _desired_links(files)
+    existing, extras = _read_tree(target)
+
+    if mode == "rebuild":
+        counts = _rebuild(target, desired, existing)
+    elif mode == "atomic":
+        counts = _atomic_swap(virtual_root, target, desired, existing, extras)
+    else:
+        # 只删除过期链接、补新链接、修正指向变化的链接，其余保持不动
+        counts = _reconcile(target, desired, existing, extras)
 
+    errors = counts["errors"] + dup
     return {
         "rule": rule.name,
         "target": str(target),
-        "linked": linked,
+        "linked": counts["added"] + counts["kept"] + counts["updated"],
         "errors": errors,
+        "added": counts["added"],
+        "removed": counts["removed"],
+        "kept": counts["kept"],
+        "updated": counts["updated"],
     }
@@ -0,0 +1,93 @@
+import threading
+import time
+from typing import Dict, Any
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 按 host 复用的连接池 Session：keep-alive + 连接错误/5xx 指数退避重试
+_config = {"pool_size": 10, "retries": 3, "backoff": 0.5}
+_sessions: Dict[str, requests.Session] = {}
+_lock = threading.Lock()
+
+_stats: Dict[str, Dict[str, Any]] = {}
+_stats_lock = threading.Lock()
+
+
+def configure(pool_size: int = 10, retries: int = 3, backoff: float = 0.5):
+    new = {"pool_size": max(1, int(pool_size)), "retries": max(0, int(retries)), "backoff": max(0.0, float(backoff))}
+    with _lock:
+        if new == _config:
+            return
+        _config.update(new)
+        old = list(_sessions.values())
+        _sessions.clear()
+    for s in old:
+        s.close()
+
+
+def _new_session() -> requests.Session:
+    retry = Retry(
+        total=_config["retries"],
+        connect=_config["retries"],
+        read=0,
+        status=_config["retries"],
+        backoff_factor=_config["backoff"],
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD", "POST"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_config["pool_size"], max_retries=retry)
+    s = requests.Session()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+
+def session_for(url: str) -> requests.Session:
+    host = urlsplit(url).netloc.lower()
+    with _lock:
+        s = _sessions.get(host)
+        if s is None:
+            s = _new_session()
+            _sessions[host] = s
+    return s
+
+
+def _record(host: str, elapsed_ms: float, error: str | None):
+    with _stats_lock:
+        x = _stats.setdefault(host, {"requests": 0, "failures": 0, "total_ms": 0.0, "last_ms": 0.0, "last_error": ""})
+        x["requests"] += 1
+        x["total_ms"] += elapsed_ms
+        x["last_ms"] = elapsed_ms
+        if error:
+            x["failures"] += 1
+            x["last_error"] = error[:200]
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", 20)
+    host = urlsplit(url).netloc.lower()
+    start = time.monotonic()
+    try:
+        r = session_for(url).request(method, url, **kwargs)
+    except Exception as e:
+        _record(host, (time.monotonic() - start) * 1000, str(e))
+        raise
+    _record(host, (time.monotonic() - start) * 1000, None if r.status_code < 500 else f"HTTP {r.status_code}")
+    return r
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def host_stats() -> Dict[str, Dict[str, Any]]:
+    with _stats_lock:
+        return {k: dict(v) for k, v in _stats.items()}
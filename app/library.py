@@ -1,8 +1,37 @@
 import os
 import re
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
-from .models import MediaFile
+from typing import List, Iterator
+from array import array
+from bisect import bisect_left, bisect_right
+from .models import MediaFile, MediaLibrary
+from .db import (
+    get_setting,
+    set_setting,
+    load_media_dirs,
+    save_media_index_changes,
+    clear_media_index,
+    iter_media_files,
+    log_media_index_changes,
+    list_media_index_changes,
+    load_match_cache,
+    clear_match_cache,
+    revalidate_match_cache,
+    save_match_cache,
+    oldest_rule_generation,
+)
+
+# 单次变更的 stem 超过这个数（如首次全量扫描）时不再逐条记日志，直接清空匹配缓存
+MATCH_CACHE_MAX_CHANGES = 5000
+MATCH_CACHE_EXPIRE_DAYS = 30
+
+# 定时运行的整库刷新和文件监听的局部刷新共用，避免两边同时改索引
+_index_lock = threading.Lock()
 
 
 def norm(s: str) -> str:
@@ -12,68 +41,741 @@ def norm(s: str) -> str:
     return s
 
 
-def scan_media_files(media_root: str, exts: List[str], max_scan: int) -> List[MediaFile]:
+def _split_ext(name: str, exts: set):
+    dot = name.rfind(".")
+    if dot <= 0:
+        return None
+    ext = name[dot:].lower()
+    return ext if ext in exts else None
+
+
+def _walk_subtree(top: str, exts: set, max_scan: int, stop: threading.Event | None = None) -> List[tuple]:
+    # 只对命中后缀的文件分配对象；同目录内按名称排序，保证输出顺序稳定
+    out = []
+    stack = [top]
+    while stack:
+        if stop is not None and stop.is_set():
+            break
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        for e in entries:
+            try:
+                if e.is_dir(follow_symlinks=False):
+                    subdirs.append(e.path)
+                elif _split_ext(e.name, exts) and e.is_file():
+                    out.append((e.path, e.name))
+                    if len(out) >= max_scan:
+                        return out
+            except OSError:
+                continue
+        stack.extend(reversed(subdirs))
+    return out
+
+
+def scan_media_files(media_root: str, exts: List[str], max_scan: int, workers: int = 1) -> List[MediaFile]:
     root = Path(media_root)
     if not root.exists():
         return []
 
     exts = {e.lower() for e in exts}
+    if workers <= 1:
+        found = _walk_subtree(str(root), exts, max_scan)
+    else:
+        # 根目录下的文件直接处理，各顶层子目录分给线程池并行遍历，按名称顺序拼接结果
+        found = []
+        subtrees = []
+        try:
+            with os.scandir(root) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            return []
+        for e in entries:
+            try:
+                if e.is_dir(follow_symlinks=False):
+                    subtrees.append(e.path)
+                elif _split_ext(e.name, exts) and e.is_file():
+                    found.append((e.path, e.name))
+            except OSError:
+                continue
+        if len(found) < max_scan:
+            for part in _map_subtrees(lambda d, limit, stop: _walk_subtree(d, exts, limit, stop), subtrees, workers, max_scan - len(found), len):
+                found.extend(part)
+
+    out = []
+    for path, name in found[:max_scan]:
+        out.append(MediaFile(path=Path(path), stem=norm(name[:name.rfind(".")])))
+    return out
+
+
+def _map_subtrees(fn, subtrees: List[str], workers: int, max_scan: int, size) -> List:
+    # 按顺序逐个提交，同时最多 workers 个在跑；已完成的前缀累计达到 max_scan 后不再提交，
+    # 并通过 stop 让还在跑的子树尽快返回。每个子树的上限取提交时剩余的配额，截断位置与线程数无关
     out = []
-    count = 0
-    for p in root.rglob("*"):
-        if p.is_file() and p.suffix.lower() in exts:
-            out.append(MediaFile(path=p, stem=norm(p.stem)))
-            count += 1
-            if count >= max_scan:
+    total = 0
+    stop = threading.Event()
+    pending = deque()
+    todo = iter(subtrees)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            while len(pending) < workers:
+                d = next(todo, None)
+                if d is None:
+                    break
+                pending.append(pool.submit(fn, d, max_scan - total if max_scan else 0, stop))
+            if not pending:
+                break
+            part = pending.popleft().result()
+            out.append(part)
+            total += size(part)
+            if max_scan and total >= max_scan:
+                stop.set()
+                for f in pending:
+                    f.cancel()
                 break
     return out
 
 
-def match_titles_to_files(
-    titles: List[str],
-    files: List[MediaFile],
-    include_keywords: List[str],
-    exclude_keywords: List[str],
-    limit: int,
-    alias_map: dict | None = None,
-) -> List[MediaFile]:
-    include_keywords = [k.lower() for k in include_keywords]
-    exclude_keywords = [k.lower() for k in exclude_keywords]
-    alias_map = alias_map or {}
+def _scan_dir(d: str, exts: set):
+    files = []
+    subdirs = []
+    with os.scandir(d) as it:
+        for e in it:
+            try:
+                if e.is_dir(follow_symlinks=False):
+                    subdirs.append(e.path)
+                    continue
+                ext = _split_ext(e.name, exts)
+                if not ext or not e.is_file():
+                    continue
+                st = e.stat()
+                files.append((e.path, norm(e.name[:-len(ext)]), ext, st.st_size, st.st_mtime))
+            except OSError:
+                continue
+    return files, subdirs
 
-    matched = []
-    used = set()
 
-    for t in titles:
-        t_norm = norm(t)
-        t_low = t.lower()
+def _list_subdirs(d: str) -> List[str]:
+    try:
+        with os.scandir(d) as it:
+            return [e.path for e in it if e.is_dir(follow_symlinks=False)]
+    except OSError:
+        return []
+
+
+def _known_children(d: str, children: dict, cut: str) -> List[str]:
+    # 上次在 max_scan 处截断时，漏掉的目录都挂在截断点及其祖先下面：只有这几个目录要重新列子目录，
+    # 其余目录照常按 mtime 跳过
+    kids = children.get(d, [])
+    if cut and (cut == d or cut.startswith(d + os.sep)):
+        kids = set(kids).union(_list_subdirs(d))
+    return sorted(kids)
+
 
-        if include_keywords and not any(k in t_low for k in include_keywords):
+def _refresh_subtree(top: str, parent: str | None, known: dict, children: dict, exts: set, limit: int = 0, cut: str = "",
+                     stop: threading.Event | None = None) -> dict:
+    # 按名称顺序深度优先遍历，order 记录访问顺序和各目录文件数，max_scan 截断时结果才稳定；
+    # 本子树累计文件数达到 limit 后停止，还有没走到的目录时记 truncated
+    res = {"changed": {}, "order": [], "dirs_scanned": 0, "dirs_skipped": 0, "truncated": False}
+    total = 0
+    stack = [(top, parent)]
+    while stack:
+        if stop is not None and stop.is_set():
+            break
+        if limit and total >= limit:
+            res["truncated"] = True
+            break
+        d, parent = stack.pop()
+        try:
+            mtime_ns = os.stat(d).st_mtime_ns
+        except OSError:
             continue
-        if exclude_keywords and any(k in t_low for k in exclude_keywords):
+        old = known.get(d)
+        # 目录 mtime 未变：文件列表沿用索引，只需继续检查已知子目录
+        if old and old["mtime_ns"] == mtime_ns and old["parent"] == parent:
+            res["dirs_skipped"] += 1
+            res["order"].append((d, old["files"]))
+            total += old["files"]
+            stack.extend((c, d) for c in reversed(_known_children(d, children, cut)))
             continue
+        try:
+            files, subdirs = _scan_dir(d, exts)
+        except OSError:
+            continue
+        res["dirs_scanned"] += 1
+        res["changed"][d] = {"parent": parent, "mtime_ns": mtime_ns, "files": files}
+        res["order"].append((d, len(files)))
+        total += len(files)
+        stack.extend((s, d) for s in sorted(subdirs, reverse=True))
+    return res
+
+
+def _merge_parts(parts: List[dict], max_scan: int, stats: dict, more: bool = False):
+    # 按遍历顺序累加文件数，达到 max_scan 后的目录不再收录（已在索引里的随后按“消失”移除）。
+    # 真的有目录没收录时才算截断（more 表示还有没提交的子树），返回最后收录的目录作为截断点
+    changed = {}
+    seen = set()
+    total = 0
+    last = ""
+    for part in parts:
+        stats["dirs_scanned"] += part["dirs_scanned"]
+        stats["dirs_skipped"] += part["dirs_skipped"]
+        for d, n in part["order"]:
+            if max_scan and total >= max_scan:
+                stats["truncated"] = True
+                return changed, seen, last
+            seen.add(d)
+            last = d
+            total += n
+            if d in part["changed"]:
+                changed[d] = part["changed"][d]
+        more = more or part["truncated"]
+    stats["truncated"] = more
+    return changed, seen, last if more else ""
+
+
+def _index_sig(root: str, exts: set) -> str:
+    return root + "|" + ",".join(sorted(exts))
+
+
+def _new_stats() -> dict:
+    stats = {"dirs_scanned": 0, "dirs_skipped": 0, "dirs_removed": 0, "files_added": 0, "files_removed": 0, "truncated": False}
+    stats["generation"] = media_index_generation()
+    # 本次真正增删的文件 stem；变动过多时为 None，表示按“全部可能受影响”处理
+    stats["changed_stems"] = []
+    return stats
+
+
+def _apply_index_changes(changed: dict, removed: List[str], stats: dict):
+    if not changed and not removed:
+        return
+    diff = save_media_index_changes(changed, removed)
+    stats["files_added"] = len(diff["added"])
+    stats["files_removed"] = len(diff["removed"])
+    # 文件集合真正变化时才推进代号，下游按代号判断结果是否可复用
+    if diff["added"] or diff["removed"]:
+        stats["generation"] = _bump_generation()
+        stems = sorted({stem for _, stem in diff["added"] + diff["removed"]})
+        if len(stems) > MATCH_CACHE_MAX_CHANGES:
+            _raise_log_floor(stats["generation"])
+            clear_match_cache()
+            stats["changed_stems"] = None
+        else:
+            log_media_index_changes(stats["generation"], stems)
+            stats["changed_stems"] = stems
+
+
+def refresh_media_index(media_root: str, exts: List[str], workers: int = 1, max_scan: int = 0) -> dict:
+    with _index_lock:
+        return _refresh_media_index(media_root, exts, workers, max_scan)
+
+
+def _refresh_media_index(media_root: str, exts: List[str], workers: int = 1, max_scan: int = 0) -> dict:
+    root = str(Path(media_root))
+    exts = {e.lower() for e in exts}
+    stats = _new_stats()
+    if not os.path.isdir(root):
+        return stats
+
+    # 根目录或后缀列表变化时整库重建
+    sig = _index_sig(root, exts)
+    if get_setting("media_index_sig", "") != sig:
+        stats["generation"] = _bump_generation()
+        _raise_log_floor(stats["generation"])
+        clear_media_index()
+        set_setting("media_index_sig", sig)
+
+    known = load_media_dirs()
+    children = {}
+    for path, x in known.items():
+        children.setdefault(x["parent"], []).append(path)
+    # 上次在 max_scan 处截断时的最后一个收录目录，空串表示索引完整
+    cut = get_setting("media_index_cut", "")
+    more = False
+
+    if workers <= 1:
+        parts = [_refresh_subtree(root, None, known, children, exts, max_scan, cut)]
+    else:
+        # 根目录单独处理，各顶层子树交给线程池，网络盘延迟可以相互重叠
+        head = {"changed": {}, "order": [], "dirs_scanned": 0, "dirs_skipped": 0, "truncated": False}
+        try:
+            mtime_ns = os.stat(root).st_mtime_ns
+        except OSError:
+            return stats
+        old = known.get(root)
+        if old and old["mtime_ns"] == mtime_ns and old["parent"] is None:
+            head["dirs_skipped"] += 1
+            head["order"].append((root, old["files"]))
+            subtrees = _known_children(root, children, cut)
+        else:
+            files, subtrees = _scan_dir(root, exts)
+            head["dirs_scanned"] += 1
+            head["changed"][root] = {"parent": None, "mtime_ns": mtime_ns, "files": files}
+            head["order"].append((root, len(files)))
+        head_files = sum(n for _, n in head["order"])
+        if max_scan and head_files >= max_scan:
+            parts = [head]
+        else:
+            parts = [head] + _map_subtrees(lambda d, limit, stop: _refresh_subtree(d, root, known, children, exts, limit, cut, stop),
+                                           sorted(subtrees), workers, max_scan and max_scan - head_files,
+                                           lambda part: sum(n for _, n in part["order"]))
+        more = len(parts) - 1 < len(subtrees)
+
+    changed, seen, last = _merge_parts(parts, max_scan, stats, more)
+    if last != cut:
+        set_setting("media_index_cut", last)
+    removed = [d for d in known if d not in seen]
+    stats["dirs_removed"] = len(removed)
+    _apply_index_changes(changed, removed, stats)
+    return stats
+
+
+def refresh_media_dirs(media_root: str, exts: List[str], dirs: List[str], max_scan: int = 0) -> dict | None:
+    # 文件监听用：只重新列出发生变化的目录，新出现的子目录整棵扫描，消失的目录连同子孙一起移除。
+    # 索引尚未按当前根目录/后缀建立、上次被 max_scan 截断或这次会超出 max_scan 时返回 None，由调用方退回整库刷新
+    root = str(Path(media_root))
+    exts = {e.lower() for e in exts}
+    with _index_lock:
+        if get_setting("media_index_sig", "") != _index_sig(root, exts) or get_setting("media_index_cut", ""):
+            return None
+        stats = _new_stats()
+        known = load_media_dirs()
+        children = {}
+        for path, x in known.items():
+            children.setdefault(x["parent"], []).append(path)
+
+        changed = {}
+        removed = set()
+
+        def drop(d: str):
+            stack = [d]
+            while stack:
+                x = stack.pop()
+                if x in known:
+                    removed.add(x)
+                stack.extend(children.get(x, []))
+
+        for d in sorted(set(dirs)):
+            if d != root and not d.startswith(root + os.sep):
+                continue
+            if not os.path.isdir(d) or os.path.islink(d):
+                drop(d)
+                continue
+            parent = None if d == root else os.path.dirname(d)
+            while parent is not None and parent not in known and parent not in changed:
+                # 父目录也不在索引里（停机期间新建、事件先到子目录等）：上溯到最近的已索引祖先之下，从那里整棵补扫
+                d = parent
+                parent = None if d == root else os.path.dirname(d)
+            if d in changed:
+                continue
+            try:
+                mtime_ns = os.stat(d).st_mtime_ns
+                files, subdirs = _scan_dir(d, exts)
+            except OSError:
+                drop(d)
+                continue
+            stats["dirs_scanned"] += 1
+            changed[d] = {"parent": parent, "mtime_ns": mtime_ns, "files": files}
+            for s in subdirs:
+                if s not in known:
+                    part = _refresh_subtree(s, d, known, children, exts)
+                    changed.update(part["changed"])
+                    stats["dirs_scanned"] += part["dirs_scanned"]
+            for c in children.get(d, []):
+                if c not in subdirs:
+                    drop(c)
+
+        removed -= set(changed)
+        if max_scan:
+            total = sum(x["files"] for d, x in known.items() if d not in removed and d not in changed)
+            if total + sum(len(x["files"]) for x in changed.values()) > max_scan:
+                return None
+        stats["dirs_removed"] = len(removed)
+        _apply_index_changes(changed, sorted(removed), stats)
+        return stats
+
+
+def media_index_generation() -> int:
+    try:
+        return int(get_setting("media_index_generation", "0"))
+    except ValueError:
+        return 0
+
+
+def _bump_generation() -> int:
+    gen = media_index_generation() + 1
+    set_setting("media_index_generation", str(gen))
+    return gen
+
 
-        candidates = [t_norm]
-        # 英文标题 -> 中文别名（或反向别名）兜底
+# media_index_log_floor：变更日志只对大于它的代号是完整的（更早的已清理或整体清空过）。
+# 总是先抬高下限再删日志，读取方先读日志再读下限，就不会把缺了日志的区间当成“没有变化”
+def _log_floor() -> int:
+    try:
+        return int(get_setting("media_index_log_floor", "0"))
+    except ValueError:
+        return 0
+
+
+def _raise_log_floor(generation: int):
+    if generation > _log_floor():
+        set_setting("media_index_log_floor", str(generation))
+
+
+def media_index_changed_stems(since: int) -> List[str] | None:
+    # since 之后增删过的文件 stem；日志已不完整时返回 None，调用方按“全部可能受影响”处理
+    changes = list_media_index_changes(since)
+    if since < _log_floor():
+        return None
+    return sorted({x["stem"] for x in changes})
+
+
+def load_indexed_files(max_scan: int, local_first: bool = False) -> MediaLibrary:
+    lib = MediaLibrary()
+    for path, stem in iter_media_files(max_scan, local_first):
+        lib.append(path, stem)
+    return lib
+
+
+def _stems(files) -> Iterator[str]:
+    if isinstance(files, MediaLibrary):
+        return files.iter_stems()
+    return (mf.stem for mf in files)
+
+
+# 候选词 -> 命中文件路径 的持久缓存，条目记录计算时的索引代号。
+# 加载时按变更日志失效：只有和新增/删除的 stem 满足 `c in stem or stem in c` 的候选才丢弃，
+# 其余条目推进到当前代号继续使用。scope 区分不同的文件范围（如 max_scan 截断）。
+class MatchCache:
+    def __init__(self, scope: str, generation: int):
+        self.scope = scope
+        self.generation = generation
+        self.entries = {}
+        self._new = {}
+        self._used = set()
+        self._load()
+
+    def _load(self):
+        # 低于日志下限的条目（多是校验之后才被更旧的读取方如并发预览写回的）无法确认是否过期，直接丢弃
+        rows = load_match_cache()
+        stale = [r["generation"] for r in rows if r["generation"] < self.generation]
+        changes = list_media_index_changes(min(stale)) if stale else []
+        floor = _log_floor()
+        dropped = []
+        kept = []
+        for r in rows:
+            c = r["candidate"]
+            if r["generation"] > self.generation:
+                # 更新的读取方写的，留给它们
+                continue
+            if r["scope"] != self.scope or r["generation"] < floor:
+                dropped.append((c, r["generation"]))
+                continue
+            if any(x["generation"] > r["generation"] and (c in x["stem"] or x["stem"] in c) for x in changes):
+                dropped.append((c, r["generation"]))
+                continue
+            self.entries[c] = json.loads(r["paths"])
+            if r["generation"] < self.generation:
+                kept.append((c, r["generation"]))
+        if self.generation < floor:
+            return
+        # 日志还要留给没跟上的规则判断是否受变动影响（见 run_once），只清理到最旧的规则代号
+        oldest = oldest_rule_generation()
+        prune_to = self.generation if oldest is None else min(self.generation, oldest)
+        _raise_log_floor(prune_to)
+        revalidate_match_cache(self.generation, dropped, kept, prune_to)
+
+    def get(self, c: str) -> List[str] | None:
+        paths = self.entries.get(c)
+        if paths is not None:
+            self._used.add(c)
+        return paths
+
+    def put(self, c: str, paths: List[str]):
+        self.entries[c] = paths
+        self._new[c] = paths
+
+    def flush(self):
+        if not self._new and not self._used:
+            return
+        now = time.time()
+        save_match_cache(
+            [(c, self.scope, self.generation, json.dumps(p, ensure_ascii=False)) for c, p in self._new.items()],
+            [c for c in self._used if c not in self._new],
+            now,
+            now - MATCH_CACHE_EXPIRE_DAYS * 86400,
+        )
+        self._new.clear()
+        self._used.clear()
+
+
+# 按 MediaFile.stem 建立的倒排索引：二元字符组 postings + 整体 stem 查表。
+# lookup(c) 返回满足 `c in stem or stem in c` 的文件下标集合，与逐个比对的结果一致。
+# 带 MatchCache 时先查缓存，全部命中的情况下倒排索引本身都不会建立。
+class StemIndex:
+
+    def __init__(self, files: MediaLibrary | List[MediaFile], cache: MatchCache | None = None):
+        self.files = files
+        self.cache = cache
+        self._memo = {}
+        self._pos = None
+        self.stem_hash = None
+
+    def _stem(self, i: int) -> str:
+        return self.files.stem_at(i) if isinstance(self.files, MediaLibrary) else self.files[i].stem
+
+    def _build(self):
+        if self.stem_hash is not None:
+            return
+        self.grams = {}
+        hashes = array("q")
+        lens = set()
+        # postings 用 array 存下标，百万级文件时比 int 列表省一半以上内存
+        for i, stem in enumerate(_stems(self.files)):
+            hashes.append(hash(stem))
+            lens.add(len(stem))
+            for g in {stem[j:j + 2] for j in range(len(stem) - 1)}:
+                p = self.grams.get(g)
+                if p is None:
+                    p = self.grams[g] = array("I")
+                p.append(i)
+        # 整体 stem 查表不保留 str 键：按 stem 哈希排序的两个平行数组，二分找到同哈希的下标后再比对原 stem
+        order = sorted(range(len(hashes)), key=hashes.__getitem__)
+        self.stem_order = array("I", order)
+        self.stem_hash = array("q", (hashes[i] for i in order))
+        self.stem_lens = sorted(lens)
+
+    def _same_stem(self, sub: str) -> List[int]:
+        h = hash(sub)
+        lo = bisect_left(self.stem_hash, h)
+        hi = bisect_right(self.stem_hash, h, lo)
+        return [i for i in self.stem_order[lo:hi] if self._stem(i) == sub]
+
+    def _containing(self, c: str) -> set:
+        if len(c) < 2:
+            return {i for i, stem in enumerate(_stems(self.files)) if c in stem}
+        postings = sorted((self.grams.get(c[j:j + 2], ()) for j in range(len(c) - 1)), key=len)
+        if not postings[0]:
+            return set()
+        cand = set(postings[0])
+        for p in postings[1:]:
+            if len(cand) <= 32:
+                break
+            cand.intersection_update(p)
+        return {i for i in cand if c in self._stem(i)}
+
+    def _contained(self, c: str) -> set:
+        out = set()
+        n = len(c)
+        for size in self.stem_lens:
+            if size > n:
+                break
+            for sub in {c[a:a + size] for a in range(n - size + 1)}:
+                out.update(self._same_stem(sub))
+        return out
+
+    def _find(self, fspath: str) -> int | None:
+        if isinstance(self.files, MediaLibrary):
+            return self.files.find(fspath)
+        if self._pos is None:
+            self._pos = {mf.fspath: i for i, mf in enumerate(self.files)}
+        return self._pos.get(fspath)
+
+    def lookup(self, c: str) -> set:
+        hit = self._memo.get(c)
+        if hit is not None:
+            return hit
+        paths = self.cache.get(c) if self.cache is not None else None
+        if paths is not None:
+            hit = {i for i in map(self._find, paths) if i is not None}
+        else:
+            self._build()
+            hit = self._containing(c) | self._contained(c)
+            if self.cache is not None:
+                self.cache.put(c, sorted(self.files[i].fspath for i in hit))
+        self._memo[c] = hit
+        return hit
+
+
+# 别名表编译后的多模式匹配自动机（Aho-Corasick）。
+# 每条 `英文=中文` 同时登记两个方向：命中英文则补充中文候选，命中中文则补充英文候选。
+class AliasMatcher:
+    def __init__(self, alias_map: dict):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        self.always = []
+        n = 0
         for k, v in alias_map.items():
             k_norm = norm(k)
             v_norm = norm(v)
-            if t_norm == k_norm or k_norm in t_norm:
-                candidates.append(v_norm)
-            if t_norm == v_norm or v_norm in t_norm:
-                candidates.append(k_norm)
+            for pat, repl in ((k_norm, v_norm), (v_norm, k_norm)):
+                if pat:
+                    self._add(pat, (n, repl))
+                else:
+                    self.always.append((n, repl))
+                n += 1
+        self._build()
+
+    def _add(self, pat: str, item: tuple):
+        node = 0
+        for ch in pat:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            node = nxt
+        self.out[node].append(item)
 
-        candidates = [c for c in dict.fromkeys(candidates) if c]
+    def _build(self):
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
 
-        for mf in files:
-            if mf.path in used:
+    def candidates(self, t_norm: str) -> List[str]:
+        hits = list(self.always)
+        node = 0
+        for ch in t_norm:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            hits.extend(self.out[node])
+        hits.sort()
+        return [t_norm] + [repl for _, repl in hits]
+
+
+def compile_alias_map(alias_map: dict | None) -> AliasMatcher:
+    return AliasMatcher(alias_map or {})
+
+
+def _match_jobs(jobs: List[dict], files, alias_map, index, key) -> List[list]:
+    # jobs: [{"titles", "include_keywords", "exclude_keywords", "limit"}]，按顺序返回各自命中的 key。
+    # 同一个规范化标题在所有规则里只解析一次，各规则再各自套用关键词过滤、去重和数量上限；
+    # key(i, candidates) 决定去重粒度（文件下标或剧集目录），candidates 是该标题连同别名的候选词；返回 None 的命中直接跳过
+    if not isinstance(alias_map, AliasMatcher):
+        alias_map = compile_alias_map(alias_map)
+    if index is None or index.files is not files:
+        index = StemIndex(files)
+
+    resolved = {}
+
+    def resolve(t_norm: str):
+        hit = resolved.get(t_norm)
+        if hit is None:
+            # 英文标题 -> 中文别名（或反向别名）兜底
+            candidates = [c for c in dict.fromkeys(alias_map.candidates(t_norm)) if c]
+            hits = set()
+            for c in candidates:
+                hits |= index.lookup(c)
+            hit = (candidates, sorted(hits))
+            resolved[t_norm] = hit
+        return hit
+
+    out = []
+    for job in jobs:
+        include_keywords = [k.lower() for k in job.get("include_keywords") or []]
+        exclude_keywords = [k.lower() for k in job.get("exclude_keywords") or []]
+        limit = job["limit"]
+        matched = []
+        used = set()
+
+        for t in job["titles"]:
+            t_low = t.lower()
+            if include_keywords and not any(k in t_low for k in include_keywords):
+                continue
+            if exclude_keywords and any(k in t_low for k in exclude_keywords):
                 continue
-            if any(c in mf.stem or mf.stem in c for c in candidates):
-                matched.append(mf)
-                used.add(mf.path)
+
+            # 按文件原顺序取第一个未使用的命中，保持原有的首个匹配语义
+            candidates, hits = resolve(norm(t))
+            for i in hits:
+                k = key(i, candidates)
+                if k is None or k in used:
+                    continue
+                matched.append(k)
+                used.add(k)
                 break
 
-        if len(matched) >= limit:
-            break
+            if len(matched) >= limit:
+                break
+        out.append(matched)
+
+    if index.cache is not None:
+        index.cache.flush()
+    return out
+
 
-    return matched
+def match_rules_to_files(
+    jobs: List[dict],
+    files: MediaLibrary | List[MediaFile],
+    alias_map: dict | AliasMatcher | None = None,
+    index: StemIndex | None = None,
+) -> List[List[MediaFile]]:
+    return [[files[i] for i in keys] for keys in _match_jobs(jobs, files, alias_map, index, lambda i, _: i)]
+
+
+_SEASON_DIR = re.compile(r"^(season|series|s)\s*\d+$|^第\s*[0-9一二三四五六七八九十百]+\s*季$|^specials?$", re.I)
+
+
+def series_dir(parent: str, media_root: str) -> str | None:
+    # 从文件所在目录向上跳过季目录（Season 1 / S01 / 第一季 / Specials），得到剧集目录；
+    # 文件直接位于媒体根目录下时没有可链接的目录
+    root = str(Path(media_root))
+    d = parent
+    while _SEASON_DIR.match(os.path.basename(d)) and os.path.dirname(d) != root and d != root:
+        d = os.path.dirname(d)
+    if d == root or not d.startswith(root + os.sep):
+        return None
+    return d
+
+
+def match_rules_to_dirs(
+    jobs: List[dict],
+    files: MediaLibrary | List[MediaFile],
+    media_root: str,
+    alias_map: dict | AliasMatcher | None = None,
+    index: StemIndex | None = None,
+) -> List[list]:
+    # 目录粒度：标题命中文件后映射到所在剧集目录，每部剧只占一个名额。
+    # 只有目录名本身与标题（或别名）对得上才链接整个目录；根目录下的散文件、
+    # 分类目录（如 Movies/Inception.mkv）里的文件退回单文件链接，结果里是文件对象（files[i]）。
+    # files 按本地优先排序时，同一标题会先落到含本地文件的目录，.strm 目录只作兜底
+    memo = {}
+
+    def key(i: int, candidates: List[str]):
+        parent = files.parent_at(i) if isinstance(files, MediaLibrary) else os.path.dirname(files[i].fspath)
+        if parent not in memo:
+            d = series_dir(parent, media_root)
+            memo[parent] = (d, norm(os.path.basename(d)) if d else "")
+        d, name = memo[parent]
+        if name and any(c in name or name in c for c in candidates):
+            return d
+        return i
+
+    return [[files[k] if isinstance(k, int) else k for k in keys] for keys in _match_jobs(jobs, files, alias_map, index, key)]
+
+
+def match_titles_to_files(
+    titles: List[str],
+    files: MediaLibrary | List[MediaFile],
+    include_keywords: List[str],
+    exclude_keywords: List[str],
+    limit: int,
+    alias_map: dict | AliasMatcher | None = None,
+    index: StemIndex | None = None,
+) -> List[MediaFile]:
+    job = {"titles": titles, "include_keywords": include_keywords, "exclude_keywords": exclude_keywords, "limit": limit}
+    return match_rules_to_files([job], files, alias_map, index)[0]
@@ -1,15 +1,25 @@
 import os
+import json
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from fastapi import FastAPI, Request, Form
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, JSONResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 
 from .config import load_config
-from .library import scan_media_files, match_titles_to_files
+from .library import norm, refresh_media_index, load_indexed_files, match_rules_to_files, match_rules_to_dirs, StemIndex, MatchCache, compile_alias_map, media_index_generation, media_index_changed_stems
 from .generator import rebuild_rule_dir
 from .scheduler import start_scheduler, apply_schedule, scheduler
-from .rss import fetch_source_titles
-from .emby import refresh_emby
+from .rss import fetch_source_titles, fetch_sources_titles, source_stats
+from . import httpclient
+from .emby import refresh_coordinator
+from .watcher import media_watcher
+from .metrics import RunMetrics, record_run, render as render_metrics
 from .db import (
     init_db,
     list_sources,
@@ -26,6 +36,14 @@ from .db import (
     set_setting,
     append_run_log,
     list_run_logs,
+    create_run,
+    finish_run,
+    list_runs,
+    last_finished_run,
+    latest_rule_results,
+    prune_history,
+    get_rule_fingerprint,
+    save_rule_fingerprint,
 )
 
 app = FastAPI(title="Emby RSS Virtual Libraries")
@@ -40,8 +58,24 @@ state = {
     "last_emby_refresh": None,
     "last_source_test": None,
     "last_rule_preview": None,
+    "current_run_id": None,
 }
 
+# title_aliases 编译结果缓存，保存系统设置时失效
+_alias_cache = {"raw": None, "matcher": None}
+
+# 后台运行：单线程执行器 + 全局单飞锁，手动/定时运行都经由 submit_run
+_run_lock = threading.Lock()
+_run_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="run")
+_runs = OrderedDict()
+_RUNS_KEEP = 20
+
+# 最近一次运行里各规则抓到的标题，文件监听据此判断哪些规则受新增/删除文件影响
+_rule_titles = {}
+# 文件监听触发的局部重链：运行冲突时攒着规则 id，稍后重试
+_watch_relink = {"pending": set(), "timer": None}
+_watch_lock = threading.Lock()
+
 PRESET_SOURCES = {
     "netflix": {"name": "Netflix 榜单(TMDB)", "kind": "tmdb", "rss_url": "media=tv&region=US&provider=8&limit=30", "platform": "Netflix"},
     "hbo": {"name": "HBO/Max 榜单(TMDB)", "kind": "tmdb", "rss_url": "media=tv&region=US&provider=1899&limit=30", "platform": "HBO/Max"},
@@ -89,14 +123,11 @@ def _split_csv(s: str):
     return [x.strip() for x in (s or "").split(",") if x.strip()]
 
 
-def _parse_ids(csv_text: str):
-    out = []
-    for x in _split_csv(csv_text):
-        try:
-            out.append(int(x))
-        except ValueError:
-            pass
-    return out
+def _to_int(v: str, default: int) -> int:
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return default
 
 
 def _parse_alias_map(raw: str) -> dict:
@@ -112,9 +143,60 @@ def _parse_alias_map(raw: str) -> dict:
     return m
 
 
+def _alias_matcher():
+    raw = get_setting("title_aliases", "")
+    if _alias_cache["matcher"] is None or _alias_cache["raw"] != raw:
+        _alias_cache["matcher"] = compile_alias_map(_parse_alias_map(raw))
+        _alias_cache["raw"] = raw
+    return _alias_cache["matcher"]
+
+
+def _configure_http():
+    try:
+        backoff = float(get_setting("http_backoff", "0.5"))
+    except ValueError:
+        backoff = 0.5
+    httpclient.configure(
+        pool_size=_to_int(get_setting("http_pool_size", "10"), 10),
+        retries=_to_int(get_setting("http_retries", "3"), 3),
+        backoff=backoff,
+    )
+
+
+def _on_emby_refresh_done(resp: dict):
+    state["last_emby_refresh"] = resp
+    append_run_log(f"emby refresh done in {resp.get('duration_s')}s: {resp}")
+
+
+refresh_coordinator.on_done = _on_emby_refresh_done
+
+
+def _request_emby_refresh(paths=None) -> dict:
+    return refresh_coordinator.request(
+        get_setting("emby_url", ""),
+        get_setting("emby_api_key", ""),
+        paths=paths,
+        debounce=_to_int(get_setting("emby_refresh_debounce", "30"), 30),
+    )
+
+
+def _emby_paths(targets):
+    # 把本容器内的虚拟库路径换算成 Emby 看到的路径
+    emby_root = get_setting("emby_virtual_root", "").strip() or VIRTUAL_ROOT
+    out = []
+    for t in targets:
+        rel = os.path.relpath(t, VIRTUAL_ROOT)
+        out.append(emby_root.rstrip("/") + "/" + rel.replace(os.sep, "/"))
+    return out
+
+
 def _common_context(active: str = "dashboard"):
     sources = list_sources()
     rules = list_rules()
+    source_rules = {}
+    for r in rules:
+        for sid in r["source_id_list"]:
+            source_rules.setdefault(sid, []).append(r["name"])
     return {
         "media_root": MEDIA_ROOT,
         "virtual_root": VIRTUAL_ROOT,
@@ -122,11 +204,11 @@ def _common_context(active: str = "dashboard"):
         "rules": rules,
         "enabled_sources": sum(1 for s in sources if int(s["enabled"]) == 1),
         "enabled_rules": sum(1 for r in rules if int(r["enabled"]) == 1),
-        "last_run": state["last_run"],
-        "last_result": state["last_result"],
-        "run_logs": list_run_logs(30),
         "emby_url": get_setting("emby_url", ""),
         "emby_auto_refresh": get_setting("emby_auto_refresh", "0"),
+        "emby_virtual_root": get_setting("emby_virtual_root", ""),
+        "emby_refresh_debounce": get_setting("emby_refresh_debounce", "30"),
+        "emby_refresh_busy": refresh_coordinator.busy(),
         "last_emby_refresh": state["last_emby_refresh"],
         "presets": PRESET_SOURCES,
         "rule_presets": PRESET_RULES,
@@ -134,11 +216,30 @@ def _common_context(active: str = "dashboard"):
         "tmdb_api_key": get_setting("tmdb_api_key", ""),
         "trakt_client_id": get_setting("trakt_client_id", ""),
         "max_scan_files": get_setting("max_scan_files", "200000"),
+        "scan_workers": get_setting("scan_workers", "4"),
+        "fetch_workers": get_setting("fetch_workers", "8"),
+        "fetch_deadline": get_setting("fetch_deadline", "300"),
+        "source_cache_ttl": get_setting("source_cache_ttl", "1800"),
+        "source_cache_stale": get_setting("source_cache_stale", "86400"),
+        "http_pool_size": get_setting("http_pool_size", "10"),
+        "http_retries": get_setting("http_retries", "3"),
+        "http_backoff": get_setting("http_backoff", "0.5"),
+        "source_stats": source_stats(),
+        "source_rules": source_rules,
         "video_exts": get_setting("video_exts", ".mkv,.mp4,.avi,.ts,.m2ts,.strm"),
         "title_aliases": get_setting("title_aliases", ""),
         "prefer_local_over_strm": get_setting("prefer_local_over_strm", "1"),
+        "link_mode": get_setting("link_mode", "reconcile"),
+        "link_granularity": get_setting("link_granularity", "file"),
+        "watch_mode": get_setting("watch_mode", "off"),
+        "watch_debounce": get_setting("watch_debounce", "60"),
+        "watch_poll_interval": get_setting("watch_poll_interval", "300"),
+        "watch_status": media_watcher.status,
+        "history_days": get_setting("history_days", "30"),
+        "metrics_enabled": get_setting("metrics_enabled", "0"),
         "last_source_test": state["last_source_test"],
         "last_rule_preview": state["last_rule_preview"],
+        "current_run_id": state["current_run_id"],
         "active": active,
     }
 
@@ -166,63 +267,339 @@ def seed_from_yaml_if_empty():
         )
 
 
-def run_once():
+def _rule_fingerprint(rule: dict, titles: list, extra: dict) -> str:
+    payload = {
+        "titles": titles,
+        "include": rule.get("include_keywords", ""),
+        "exclude": rule.get("exclude_keywords", ""),
+        "max_items": int(rule.get("max_items", 100)),
+        "target": rule.get("target_subdir", ""),
+        **extra,
+    }
+    return hashlib.sha1(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _phase(progress: dict | None, phase: str, metrics: RunMetrics | None = None):
+    if metrics is not None:
+        metrics.phase(phase)
+    if progress is not None:
+        progress["phase"] = phase
+
+
+def run_once(progress: dict | None = None, rule_ids: list | None = None):
+    t0 = time.monotonic()
+    m = RunMetrics()
+    m.phase("setup")
+    run_db_id = create_run(progress["id"] if progress else uuid.uuid4().hex[:12], progress["trigger"] if progress else "direct")
+    if progress is not None:
+        progress["_db_id"] = run_db_id
     cfg = load_config()
     max_scan = int(get_setting("max_scan_files", str(cfg.settings.max_scan_files)) or cfg.settings.max_scan_files)
+    scan_workers = _to_int(get_setting("scan_workers", str(cfg.settings.scan_workers)), cfg.settings.scan_workers)
     video_exts = _split_csv(get_setting("video_exts", ",".join(cfg.settings.video_exts))) or cfg.settings.video_exts
     prefer_local = get_setting("prefer_local_over_strm", "1") == "1"
-    alias_map = _parse_alias_map(get_setting("title_aliases", ""))
+    alias_map = _alias_matcher()
+    link_mode = get_setting("link_mode", "reconcile")
+    by_dir = get_setting("link_granularity", "file") == "series"
 
     os.environ["TMDB_API_KEY"] = get_setting("tmdb_api_key", os.getenv("TMDB_API_KEY", ""))
     os.environ["TRAKT_CLIENT_ID"] = get_setting("trakt_client_id", os.getenv("TRAKT_CLIENT_ID", ""))
-
-    files = scan_media_files(MEDIA_ROOT, video_exts, max_scan)
-    if prefer_local:
-        files.sort(key=lambda f: 1 if f.path.suffix.lower() == ".strm" else 0)
+    _configure_http()
+
+    if rule_ids is None:
+        _phase(progress, "scan", m)
+        index_stats = refresh_media_index(MEDIA_ROOT, video_exts, scan_workers, max_scan)
+    else:
+        # 文件监听触发的局部运行：索引已由 watcher 增量更新，不再扫描
+        index_stats = {"dirs_scanned": 0, "dirs_skipped": 0, "files_added": 0, "files_removed": 0, "generation": media_index_generation()}
+    # 文件列表和倒排索引按需加载：所有规则都命中指纹时整个匹配阶段都不用做
+    lib = {}
+
+    def library():
+        if not lib:
+            files = load_indexed_files(max_scan, prefer_local)
+            m.inc("library_files", len(files))
+            lib["files"] = files
+            lib["index"] = StemIndex(files, MatchCache(str(max_scan), index_stats["generation"]))
+        return lib["files"], lib["index"]
+
+    fp_extra = {
+        "aliases": get_setting("title_aliases", ""),
+        "prefer_local": prefer_local,
+        "link_mode": link_mode,
+        "by_dir": by_dir,
+        "max_scan": max_scan,
+    }
 
     src_map = {s["id"]: s for s in list_sources()}
-    result = []
-
-    for rule in list_rules():
-        if not int(rule.get("enabled", 1)):
-            continue
-
-        titles = []
-        for sid in _parse_ids(rule.get("source_ids", "")):
+    rules = [r for r in list_rules() if int(r.get("enabled", 1))]
+    if rule_ids is not None:
+        rules = [r for r in rules if r["id"] in set(rule_ids)]
+    wanted = []
+    for rule in rules:
+        for sid in rule["source_id_list"]:
             src = src_map.get(sid)
-            if src:
-                titles.extend(fetch_source_titles(src))
-
-        matched = match_titles_to_files(
-            titles=titles,
-            files=files,
-            include_keywords=_split_csv(rule.get("include_keywords", "")),
-            exclude_keywords=_split_csv(rule.get("exclude_keywords", "")),
-            limit=int(rule.get("max_items", 100)),
-            alias_map=alias_map,
-        )
-
-        class _R:
-            name = rule["name"]
-            target_subdir = rule["target_subdir"]
-
-        result.append(rebuild_rule_dir(VIRTUAL_ROOT, _R, matched))
+            if src and int(src.get("enabled", 1)):
+                wanted.append(src)
+    _phase(progress, "fetch", m)
+    m.begin_fetch()
+    fetched = fetch_sources_titles(
+        wanted,
+        workers=_to_int(get_setting("fetch_workers", "8"), 8),
+        deadline=_to_int(get_setting("fetch_deadline", "300"), 300),
+        allow_stale=False,
+    )
+    m.end_fetch()
+    m.inc("titles_fetched", sum(len(v) for v in fetched.values()))
+    timed_out = sorted({s["id"] for s in wanted} - set(fetched))
+    m.inc("sources_timed_out", len(timed_out))
+    if timed_out:
+        append_run_log(f"fetch timeout (no cached titles): sources {timed_out}")
+
+    _phase(progress, "link")
+    m.phase("fingerprint")
+    if progress is not None:
+        progress["rules"] = [{"name": r["name"], "status": "pending"} for r in rules]
+    result = [None] * len(rules)
+    pending = []
+    gen = index_stats["generation"]
+    changed_since = {}
+    for i, rule in enumerate(rules):
+        titles = []
+        for sid in rule["source_id_list"]:
+            titles.extend(fetched.get(sid, []))
+        prev = get_rule_fingerprint(rule["id"])
+        target = os.path.join(VIRTUAL_ROOT, rule["target_subdir"])
+        incomplete = any(sid in timed_out for sid in rule["source_id_list"])
+        if not incomplete:
+            _rule_titles[rule["id"]] = titles
+        fp = _rule_fingerprint(rule, titles, fp_extra)
+        unchanged = bool(prev and prev["fingerprint"] == fp and prev["result"] and os.path.isdir(target))
+        if unchanged and not incomplete and prev["generation"] != gen:
+            # 媒体索引在规则上次运行后有变动：只有变动的 stem 与本规则的标题候选相关时才重建
+            since = prev["generation"]
+            if since not in changed_since:
+                changed_since[since] = media_index_changed_stems(since)
+            unchanged = not _rule_affected(rule, titles, changed_since[since], alias_map)
+            if unchanged:
+                save_rule_fingerprint(rule["id"], fp, prev["result"], gen)
+        if incomplete or unchanged:
+            # 标题、规则参数、别名没变且媒体库变动与本规则无关：沿用上次结果，不重新匹配和链接。
+            # 有来源超时且没有缓存时同样保留现有链接，避免一次慢请求清空整个虚拟库
+            r = json.loads(prev["result"]) if prev and prev["result"] else {"target": target, "linked": 0, "errors": 0}
+            r.update(rule=rule["name"], rule_id=rule["id"], added=0, removed=0, updated=0, kept=r.get("linked", 0), skipped=True, elapsed_ms=0)
+            result[i] = r
+            if progress is not None:
+                progress["rules"][i].update(status="done", linked=r["linked"], errors=r["errors"], skipped=True)
+            continue
+        pending.append((i, rule, titles, fp))
+
+    if pending:
+        # 所有需要重建的规则一次性匹配，共享标题在媒体库里只解析一次
+        m.phase("load")
+        files, index = library()
+        m.phase("match")
+        jobs = [
+            {
+                "titles": titles,
+                "include_keywords": _split_csv(rule.get("include_keywords", "")),
+                "exclude_keywords": _split_csv(rule.get("exclude_keywords", "")),
+                "limit": int(rule.get("max_items", 100)),
+            }
+            for _, rule, titles, _ in pending
+        ]
+        if by_dir:
+            matches = match_rules_to_dirs(jobs, files, MEDIA_ROOT, alias_map, index)
+        else:
+            matches = match_rules_to_files(jobs, files, alias_map, index)
+        m.inc("matches", sum(len(x) for x in matches))
+
+        m.phase("link")
+        for (i, rule, _, fp), matched in zip(pending, matches):
+            if progress is not None:
+                progress["rules"][i]["status"] = "running"
+
+            class _R:
+                name = rule["name"]
+                target_subdir = rule["target_subdir"]
+
+            t_rule = time.monotonic()
+            if by_dir:
+                result[i] = rebuild_rule_dir(VIRTUAL_ROOT, _R, [], mode=link_mode, dirs=matched)
+            else:
+                result[i] = rebuild_rule_dir(VIRTUAL_ROOT, _R, matched, mode=link_mode)
+            result[i].update(rule_id=rule["id"], elapsed_ms=int((time.monotonic() - t_rule) * 1000))
+            m.rule(rule["name"], time.monotonic() - t_rule)
+            save_rule_fingerprint(rule["id"], fp, json.dumps(result[i], ensure_ascii=False), gen)
+            if progress is not None:
+                progress["rules"][i].update(status="done", linked=result[i]["linked"], errors=result[i]["errors"])
 
     state["last_run"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     state["last_result"] = result
-    append_run_log(f"run: {len(result)} rules")
-
+    skipped = sum(1 for r in result if r.get("skipped"))
+    append_run_log(
+        f"run: {len(result)} rules ({skipped} unchanged), index gen {index_stats['generation']} "
+        f"(scanned {index_stats['dirs_scanned']} dirs, skipped {index_stats['dirs_skipped']}, +{index_stats['files_added']}/-{index_stats['files_removed']} files)"
+    )
     emby_url = get_setting("emby_url", "")
     emby_key = get_setting("emby_api_key", "")
     auto_refresh = get_setting("emby_auto_refresh", "0") == "1"
     if auto_refresh and emby_url and emby_key:
-        resp = refresh_emby(emby_url, emby_key)
-        state["last_emby_refresh"] = resp
-        append_run_log(f"emby refresh: {resp}")
-
+        _phase(progress, "emby", m)
+        changed = _emby_paths([r["target"] for r in result if r.get("added") or r.get("removed") or r.get("updated")])
+        if changed:
+            resp = _request_emby_refresh(changed)
+            state["last_emby_refresh"] = resp
+            append_run_log(f"emby refresh requested: {resp}")
+        else:
+            append_run_log("emby refresh skipped: no virtual library changed")
+
+    m.finish()
+    for k in ("dirs_scanned", "dirs_skipped", "files_added", "files_removed"):
+        m.inc(k, index_stats[k])
+    m.inc("rules", len(result))
+    m.inc("rules_skipped", skipped)
+    for k in ("added", "removed", "updated"):
+        m.inc(f"links_{k}", sum(r.get(k, 0) for r in result))
+    m.inc("link_errors", sum(r.get("errors", 0) for r in result))
+    if get_setting("metrics_enabled", "0") == "1":
+        record_run(m)
+    finish_run(run_db_id, "done", int((time.monotonic() - t0) * 1000), result, index_stats, metrics=m.as_dict())
+    prune_history(_to_int(get_setting("history_days", "30"), 30))
     return result
 
 
+def _run_job(progress: dict, rule_ids: list | None = None):
+    try:
+        run_once(progress, rule_ids)
+        progress["status"] = "done"
+    except Exception as e:
+        progress["status"] = "failed"
+        progress["error"] = str(e)
+        append_run_log(f"run failed: {e}")
+        if progress.get("_db_id"):
+            try:
+                finish_run(progress["_db_id"], "failed", int((time.monotonic() - progress["_t0"]) * 1000), [], error=str(e))
+            except Exception:
+                pass
+    finally:
+        progress["phase"] = "finished"
+        progress["finished_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        progress["elapsed_s"] = round(time.monotonic() - progress["_t0"], 1)
+        state["current_run_id"] = None
+        _run_lock.release()
+
+
+def submit_run(trigger: str = "manual", rule_ids: list | None = None) -> dict:
+    # 已有运行在进行时不排队，直接返回正在运行的那一次
+    if not _run_lock.acquire(blocking=False):
+        return {"accepted": False, "run_id": state.get("current_run_id")}
+    run_id = uuid.uuid4().hex[:12]
+    progress = {
+        "id": run_id,
+        "trigger": trigger,
+        "status": "running",
+        "phase": "queued",
+        "rules": [],
+        "rule_ids": rule_ids,
+        "started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "_t0": time.monotonic(),
+    }
+    _runs[run_id] = progress
+    while len(_runs) > _RUNS_KEEP:
+        _runs.popitem(last=False)
+    state["current_run_id"] = run_id
+    try:
+        _run_executor.submit(_run_job, progress, rule_ids)
+    except Exception:
+        state["current_run_id"] = None
+        _run_lock.release()
+        raise
+    return {"accepted": True, "run_id": run_id}
+
+
+def _scheduled_run():
+    resp = submit_run("schedule")
+    if not resp["accepted"]:
+        append_run_log(f"scheduled run skipped: run {resp['run_id']} still in progress")
+
+
+def _rule_affected(rule: dict, titles: list | None, stems: list | None, alias_map) -> bool:
+    # 规则的任一标题（含别名候选）与变动文件的 stem 互为子串时才算受影响；
+    # 变动过多（stems 为 None）或规则还没跑过（titles 为 None）时一律视为受影响
+    if stems is None or titles is None:
+        return True
+    include = [k.lower() for k in _split_csv(rule.get("include_keywords", ""))]
+    exclude = [k.lower() for k in _split_csv(rule.get("exclude_keywords", ""))]
+    for t in titles:
+        t_low = t.lower()
+        if include and not any(k in t_low for k in include):
+            continue
+        if exclude and any(k in t_low for k in exclude):
+            continue
+        if any(c and any(c in s or s in c for s in stems) for c in alias_map.candidates(norm(t))):
+            return True
+    return False
+
+
+def _affected_rules(stems: list | None) -> list:
+    alias_map = _alias_matcher()
+    return [
+        rule["id"] for rule in list_rules()
+        if int(rule.get("enabled", 1)) and _rule_affected(rule, _rule_titles.get(rule["id"]), stems, alias_map)
+    ]
+
+
+def _submit_watch_relink(rule_ids: list = ()):
+    with _watch_lock:
+        _watch_relink["timer"] = None
+        _watch_relink["pending"].update(rule_ids)
+        if not _watch_relink["pending"]:
+            return
+        resp = submit_run("watch", sorted(_watch_relink["pending"]))
+        if resp["accepted"]:
+            _watch_relink["pending"].clear()
+            return
+        # 已有运行在进行（通常是定时整库运行）：稍后再试，期间新的规则继续攒进 pending
+        if _watch_relink["timer"] is None:
+            t = threading.Timer(30, _submit_watch_relink)
+            t.daemon = True
+            _watch_relink["timer"] = t
+            t.start()
+
+
+def _on_media_change(stats: dict):
+    rule_ids = _affected_rules(stats.get("changed_stems"))
+    append_run_log(f"watch: +{stats['files_added']}/-{stats['files_removed']} files, relink rules {rule_ids}")
+    if rule_ids:
+        _submit_watch_relink(rule_ids)
+
+
+def _configure_watcher():
+    cfg = load_config()
+    video_exts = _split_csv(get_setting("video_exts", ",".join(cfg.settings.video_exts))) or cfg.settings.video_exts
+    media_watcher.start(
+        MEDIA_ROOT,
+        video_exts,
+        get_setting("watch_mode", "off"),
+        debounce=_to_int(get_setting("watch_debounce", "60"), 60),
+        poll_interval=_to_int(get_setting("watch_poll_interval", "300"), 300),
+        max_scan=_to_int(get_setting("max_scan_files", str(cfg.settings.max_scan_files)), cfg.settings.max_scan_files),
+    )
+
+
+media_watcher.on_change = _on_media_change
+
+
+def _run_view(progress: dict) -> dict:
+    out = {k: v for k, v in progress.items() if not k.startswith("_")}
+    if progress["status"] == "running":
+        out["elapsed_s"] = round(time.monotonic() - progress["_t0"], 1)
+    out["rules_done"] = sum(1 for r in progress["rules"] if r["status"] == "done")
+    out["rules_total"] = len(progress["rules"])
+    return out
+
+
 @app.on_event("startup")
 def startup_event():
     os.makedirs(VIRTUAL_ROOT, exist_ok=True)
@@ -230,7 +607,12 @@ def startup_event():
     seed_from_yaml_if_empty()
     if not get_setting("cron_expr", ""):
         set_setting("cron_expr", os.getenv("CRON_EXPR", "30 3 * * *"))
-    start_scheduler(run_once, get_setting("cron_expr", "30 3 * * *"))
+    _configure_http()
+    start_scheduler(_scheduled_run, get_setting("cron_expr", "30 3 * * *"))
+    _configure_watcher()
+    last = last_finished_run()
+    if last:
+        state["last_run"] = last["finished_at"]
 
 
 @app.get("/")
@@ -240,7 +622,15 @@ def root():
 
 @app.get("/dashboard")
 def dashboard(request: Request):
-    return templates.TemplateResponse("dashboard.html", {"request": request, **_common_context("dashboard")})
+    ctx = _common_context("dashboard")
+    ctx["run_id"] = request.query_params.get("run_id") or ctx["current_run_id"] or ""
+    # 最近结果从运行历史表读，重启后也还在
+    last = last_finished_run()
+    ctx["last_run"] = last["finished_at"] if last else None
+    ctx["last_result"] = [dict(x, rule=x["rule_name"]) for x in last["results"]] if last else []
+    ctx["runs"] = list_runs(20, _to_int(request.query_params.get("before", ""), 0) or None)
+    ctx["runs_before"] = ctx["runs"][-1]["id"] if len(ctx["runs"]) == 20 else None
+    return templates.TemplateResponse("dashboard.html", {"request": request, **ctx})
 
 
 @app.get("/sources")
@@ -250,12 +640,17 @@ def sources_page(request: Request):
 
 @app.get("/rules")
 def rules_page(request: Request):
-    return templates.TemplateResponse("rules.html", {"request": request, **_common_context("rules")})
+    ctx = _common_context("rules")
+    ctx["rule_last"] = latest_rule_results()
+    return templates.TemplateResponse("rules.html", {"request": request, **ctx})
 
 
 @app.get("/logs")
 def logs_page(request: Request):
-    return templates.TemplateResponse("logs.html", {"request": request, **_common_context("logs")})
+    ctx = _common_context("logs")
+    ctx["run_logs"] = list_run_logs(50, _to_int(request.query_params.get("before", ""), 0) or None)
+    ctx["logs_before"] = ctx["run_logs"][-1]["id"] if len(ctx["run_logs"]) == 50 else None
+    return templates.TemplateResponse("logs.html", {"request": request, **ctx})
 
 
 @app.get("/settings")
@@ -269,9 +664,19 @@ def emby_page(request: Request):
 
 
 @app.post("/run")
-def run_now():
-    run_once()
-    return RedirectResponse(url="/dashboard", status_code=303)
+def run_now(request: Request):
+    resp = submit_run("manual")
+    if "application/json" in request.headers.get("accept", ""):
+        return JSONResponse(resp, status_code=202 if resp["accepted"] else 409)
+    return RedirectResponse(url=f"/dashboard?run_id={resp['run_id'] or ''}", status_code=303)
+
+
+@app.get("/runs/{run_id}")
+def run_status(run_id: str):
+    progress = _runs.get(run_id)
+    if not progress:
+        return JSONResponse({"error": "run not found"}, status_code=404)
+    return _run_view(progress)
 
 
 @app.post("/sources")
@@ -361,18 +766,20 @@ def rule_update(rule_id: int, name: str = Form(...), target_subdir: str = Form(.
 
 
 @app.post("/emby/settings")
-def save_emby_settings(emby_url: str = Form(""), emby_api_key: str = Form(""), emby_auto_refresh: str = Form("0")):
+def save_emby_settings(emby_url: str = Form(""), emby_api_key: str = Form(""), emby_auto_refresh: str = Form("0"), emby_virtual_root: str = Form(""), emby_refresh_debounce: str = Form("30")):
     set_setting("emby_url", emby_url.strip())
     set_setting("emby_api_key", emby_api_key.strip())
     set_setting("emby_auto_refresh", "1" if emby_auto_refresh == "1" else "0")
+    set_setting("emby_virtual_root", emby_virtual_root.strip())
+    set_setting("emby_refresh_debounce", str(max(0, _to_int(emby_refresh_debounce.strip(), 30))))
     return RedirectResponse(url="/emby", status_code=303)
 
 
 @app.post("/emby/refresh")
 def emby_refresh_now():
-    resp = refresh_emby(get_setting("emby_url", ""), get_setting("emby_api_key", ""))
+    resp = _request_emby_refresh()
     state["last_emby_refresh"] = resp
-    append_run_log(f"emby manual refresh: {resp}")
+    append_run_log(f"emby manual refresh requested: {resp}")
     return RedirectResponse(url="/emby", status_code=303)
 
 
@@ -382,19 +789,52 @@ def save_system_settings(
     tmdb_api_key: str = Form(""),
     trakt_client_id: str = Form(""),
     max_scan_files: str = Form("200000"),
+    scan_workers: str = Form("4"),
+    fetch_workers: str = Form("8"),
+    fetch_deadline: str = Form("300"),
+    source_cache_ttl: str = Form("1800"),
+    source_cache_stale: str = Form("86400"),
+    http_pool_size: str = Form("10"),
+    http_retries: str = Form("3"),
+    http_backoff: str = Form("0.5"),
     video_exts: str = Form(".mkv,.mp4,.avi,.ts,.m2ts,.strm"),
     title_aliases: str = Form(""),
     prefer_local_over_strm: str = Form("1"),
+    link_mode: str = Form("reconcile"),
+    link_granularity: str = Form("file"),
+    watch_mode: str = Form("off"),
+    watch_debounce: str = Form("60"),
+    watch_poll_interval: str = Form("300"),
+    history_days: str = Form("30"),
+    metrics_enabled: str = Form("0"),
 ):
     set_setting("cron_expr", cron_expr.strip() or "30 3 * * *")
     set_setting("tmdb_api_key", tmdb_api_key.strip())
     set_setting("trakt_client_id", trakt_client_id.strip())
     set_setting("max_scan_files", max_scan_files.strip() or "200000")
+    set_setting("scan_workers", str(max(1, _to_int(scan_workers.strip(), 4))))
+    set_setting("fetch_workers", str(max(1, _to_int(fetch_workers.strip(), 8))))
+    set_setting("fetch_deadline", str(max(10, _to_int(fetch_deadline.strip(), 300))))
+    set_setting("source_cache_ttl", str(max(0, _to_int(source_cache_ttl.strip(), 1800))))
+    set_setting("source_cache_stale", str(max(0, _to_int(source_cache_stale.strip(), 86400))))
+    set_setting("http_pool_size", str(max(1, _to_int(http_pool_size.strip(), 10))))
+    set_setting("http_retries", str(max(0, _to_int(http_retries.strip(), 3))))
+    set_setting("http_backoff", http_backoff.strip() or "0.5")
+    _configure_http()
     set_setting("video_exts", video_exts.strip() or ".mkv,.mp4,.avi,.ts,.m2ts,.strm")
     set_setting("title_aliases", title_aliases.strip())
+    _alias_cache["matcher"] = None
     set_setting("prefer_local_over_strm", "1" if prefer_local_over_strm == "1" else "0")
-
-    apply_schedule(run_once, get_setting("cron_expr", "30 3 * * *"))
+    set_setting("link_mode", link_mode if link_mode in {"reconcile", "atomic", "rebuild"} else "reconcile")
+    set_setting("link_granularity", "series" if link_granularity == "series" else "file")
+    set_setting("watch_mode", watch_mode if watch_mode in {"off", "auto", "poll"} else "off")
+    set_setting("watch_debounce", str(max(1, _to_int(watch_debounce.strip(), 60))))
+    set_setting("watch_poll_interval", str(max(10, _to_int(watch_poll_interval.strip(), 300))))
+    _configure_watcher()
+    set_setting("history_days", str(max(1, _to_int(history_days.strip(), 30))))
+    set_setting("metrics_enabled", "1" if metrics_enabled == "1" else "0")
+
+    apply_schedule(_scheduled_run, get_setting("cron_expr", "30 3 * * *"))
     if not scheduler.running:
         scheduler.start()
 
@@ -403,7 +843,7 @@ def save_system_settings(
 
 
 @app.post("/sources/{source_id}/test")
-def source_test(source_id: int):
+def source_test(source_id: int, force: str = Form("0")):
     os.environ["TMDB_API_KEY"] = get_setting("tmdb_api_key", os.getenv("TMDB_API_KEY", ""))
     os.environ["TRAKT_CLIENT_ID"] = get_setting("trakt_client_id", os.getenv("TRAKT_CLIENT_ID", ""))
 
@@ -412,9 +852,10 @@ def source_test(source_id: int):
         state["last_source_test"] = {"error": "source not found"}
         return RedirectResponse(url="/sources", status_code=303)
 
-    titles = fetch_source_titles(src)
+    titles = fetch_source_titles(src, force=force == "1")
     state["last_source_test"] = {
         "source": src["name"],
+        "force": force == "1",
         "count": len(titles),
         "sample": titles[:20],
         "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -427,16 +868,21 @@ def source_test(source_id: int):
 def rule_preview(rule_id: int):
     cfg = load_config()
     max_scan = int(get_setting("max_scan_files", str(cfg.settings.max_scan_files)) or cfg.settings.max_scan_files)
+    scan_workers = _to_int(get_setting("scan_workers", str(cfg.settings.scan_workers)), cfg.settings.scan_workers)
     video_exts = _split_csv(get_setting("video_exts", ",".join(cfg.settings.video_exts))) or cfg.settings.video_exts
     prefer_local = get_setting("prefer_local_over_strm", "1") == "1"
-    alias_map = _parse_alias_map(get_setting("title_aliases", ""))
+    alias_map = _alias_matcher()
 
     os.environ["TMDB_API_KEY"] = get_setting("tmdb_api_key", os.getenv("TMDB_API_KEY", ""))
     os.environ["TRAKT_CLIENT_ID"] = get_setting("trakt_client_id", os.getenv("TRAKT_CLIENT_ID", ""))
 
-    files = scan_media_files(MEDIA_ROOT, video_exts, max_scan)
-    if prefer_local:
-        files.sort(key=lambda f: 1 if f.path.suffix.lower() == ".strm" else 0)
+    # 代号要在读文件列表之前取：中间被 watcher 推进时，缓存记在旧代号下，下次会按变更日志失效
+    gen = media_index_generation()
+    files = load_indexed_files(max_scan, prefer_local)
+    if not files:
+        gen = refresh_media_index(MEDIA_ROOT, video_exts, scan_workers, max_scan)["generation"]
+        files = load_indexed_files(max_scan, prefer_local)
+    index = StemIndex(files, MatchCache(str(max_scan), gen))
 
     src_map = {s["id"]: s for s in list_sources()}
     rule = next((r for r in list_rules() if r["id"] == rule_id), None)
@@ -444,31 +890,53 @@ def rule_preview(rule_id: int):
         state["last_rule_preview"] = {"error": "rule not found"}
         return RedirectResponse(url="/rules", status_code=303)
 
-    titles = []
-    for sid in _parse_ids(rule.get("source_ids", "")):
-        src = src_map.get(sid)
-        if src:
-            titles.extend(fetch_source_titles(src))
-
-    matched = match_titles_to_files(
-        titles=titles,
-        files=files,
-        include_keywords=_split_csv(rule.get("include_keywords", "")),
-        exclude_keywords=_split_csv(rule.get("exclude_keywords", "")),
-        limit=min(int(rule.get("max_items", 100)), 30),
-        alias_map=alias_map,
+    rule_ids = rule["source_id_list"]
+    fetched = fetch_sources_titles(
+        [src_map[sid] for sid in rule_ids if sid in src_map],
+        workers=_to_int(get_setting("fetch_workers", "8"), 8),
+        deadline=_to_int(get_setting("fetch_deadline", "300"), 300),
     )
+    titles = []
+    for sid in rule_ids:
+        titles.extend(fetched.get(sid, []))
+
+    job = {
+        "titles": titles,
+        "include_keywords": _split_csv(rule.get("include_keywords", "")),
+        "exclude_keywords": _split_csv(rule.get("exclude_keywords", "")),
+        "limit": min(int(rule.get("max_items", 100)), 30),
+    }
+    if get_setting("link_granularity", "file") == "series":
+        sample = [x if isinstance(x, str) else x.fspath for x in match_rules_to_dirs([job], files, MEDIA_ROOT, alias_map, index)[0]]
+    else:
+        sample = [x.fspath for x in match_rules_to_files([job], files, alias_map, index)[0]]
 
     state["last_rule_preview"] = {
         "rule": rule["name"],
-        "count": len(matched),
-        "sample": [str(x.path) for x in matched[:20]],
+        "count": len(sample),
+        "sample": sample[:20],
         "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
     }
-    append_run_log(f"rule preview: {rule['name']} => {len(matched)}")
+    append_run_log(f"rule preview: {rule['name']} => {len(sample)}")
     return RedirectResponse(url="/rules", status_code=303)
 
 
+@app.get("/stats/http")
+def http_stats():
+    return {"sources": source_stats(), "hosts": httpclient.host_stats()}
+
+
+@app.get("/metrics")
+def metrics():
+    if get_setting("metrics_enabled", "0") != "1":
+        return PlainTextResponse("metrics disabled\n", status_code=404)
+    body = render_metrics({
+        "media_index_generation": media_index_generation(),
+        "run_in_progress": 1 if state["current_run_id"] else 0,
+    })
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/health")
 def health():
     return {"ok": True, "last_run": state["last_run"]}
@@ -0,0 +1,119 @@
+import threading
+import time
+from typing import Dict, Any, List
+
+from . import httpclient
+from .rss import source_stats
+
+_PREFIX = "emby_rss"
+
+# 单次运行的指标：按阶段计时、各规则/来源耗时和文件/标题/链接计数。
+# 只在阶段切换和规则结束时记一次时间，不进入扫描和匹配的内层循环，关闭 /metrics 时也几乎没有开销
+class RunMetrics:
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.rules: Dict[str, float] = {}
+        self.sources: Dict[str, Dict[str, Any]] = {}
+        self._cur = None
+        self._src0 = {}
+        self._http0 = {}
+
+    def phase(self, name: str):
+        now = time.monotonic()
+        if self._cur is not None:
+            prev, start = self._cur
+            self.phases[prev] = self.phases.get(prev, 0.0) + now - start
+        self._cur = (name, now) if name else None
+
+    def finish(self):
+        self.phase("")
+
+    def inc(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def rule(self, name: str, seconds: float):
+        self.rules[name] = self.rules.get(name, 0.0) + seconds
+
+    def begin_fetch(self):
+        self._src0 = source_stats()
+        self._http0 = httpclient.host_stats()
+
+    def end_fetch(self):
+        # 来源/HTTP 统计本身是进程级累计值，这里取本次运行前后的差
+        for sid, x in source_stats().items():
+            old = self._src0.get(sid, {})
+            d = {k: x[k] - old.get(k, 0) for k in ("requests", "failures", "cache_hits", "total_ms")}
+            if d["requests"] or d["cache_hits"]:
+                self.sources[str(sid)] = {"name": x["name"], "requests": d["requests"], "failures": d["failures"],
+                                          "cache_hits": d["cache_hits"], "seconds": round(d["total_ms"] / 1000, 3)}
+        for host, x in httpclient.host_stats().items():
+            old = self._http0.get(host, {})
+            self.inc("http_requests", x["requests"] - old.get("requests", 0))
+            self.inc("http_errors", x["failures"] - old.get("failures", 0))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "phases": {k: round(v, 3) for k, v in self.phases.items()},
+            "counters": dict(self.counters),
+            "rules": {k: round(v, 3) for k, v in self.rules.items()},
+            "sources": self.sources,
+        }
+
+
+_lock = threading.Lock()
+_totals = {"runs": 0, "phases": {}, "counters": {}, "rules": {}, "last": None, "last_at": 0.0}
+
+
+def record_run(m: RunMetrics):
+    d = m.as_dict()
+    with _lock:
+        _totals["runs"] += 1
+        for key in ("phases", "counters", "rules"):
+            acc = _totals[key]
+            for k, v in d[key].items():
+                acc[k] = acc.get(k, 0) + v
+        _totals["last"] = d
+        _totals["last_at"] = time.time()
+
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _metric(out: List[str], name: str, kind: str, help_text: str, samples):
+    out.append(f"# HELP {_PREFIX}_{name} {help_text}")
+    out.append(f"# TYPE {_PREFIX}_{name} {kind}")
+    for labels, value in samples:
+        lbl = ",".join(f'{k}="{_esc(v)}"' for k, v in labels.items())
+        out.append(f"{_PREFIX}_{name}{{{lbl}}} {value}" if lbl else f"{_PREFIX}_{name} {value}")
+
+
+def render(extra_gauges: Dict[str, float] | None = None) -> str:
+    with _lock:
+        t = {k: (dict(v) if isinstance(v, dict) else v) for k, v in _totals.items()}
+    last = t["last"] or {"phases": {}, "counters": {}, "rules": {}}
+    out: List[str] = []
+    _metric(out, "runs_total", "counter", "Completed runs since start.", [({}, t["runs"])])
+    _metric(out, "last_run_timestamp_seconds", "gauge", "Unix time the last run finished.", [({}, round(t["last_at"], 3))])
+    _metric(out, "phase_seconds_total", "counter", "Time spent per run phase.", [({"phase": k}, round(v, 3)) for k, v in sorted(t["phases"].items())])
+    _metric(out, "last_phase_seconds", "gauge", "Time spent per phase in the last run.", [({"phase": k}, v) for k, v in sorted(last["phases"].items())])
+    for k, v in sorted(t["counters"].items()):
+        _metric(out, f"{k}_total", "counter", f"Cumulative {k.replace('_', ' ')} across runs.", [({}, v)])
+    _metric(out, "rule_seconds_total", "counter", "Link time per rule.", [({"rule": k}, round(v, 3)) for k, v in sorted(t["rules"].items())])
+    _metric(out, "rule_last_seconds", "gauge", "Link time per rule in the last run.", [({"rule": k}, v) for k, v in sorted(last["rules"].items())])
+
+    src = sorted(source_stats().items(), key=lambda kv: str(kv[0]))
+    _metric(out, "source_requests_total", "counter", "Fetches per source.", [({"source": x["name"], "id": k}, x["requests"]) for k, x in src])
+    _metric(out, "source_failures_total", "counter", "Failed fetches per source.", [({"source": x["name"], "id": k}, x["failures"]) for k, x in src])
+    _metric(out, "source_cache_hits_total", "counter", "Cache hits per source.", [({"source": x["name"], "id": k}, x["cache_hits"]) for k, x in src])
+    _metric(out, "source_fetch_seconds_total", "counter", "Fetch time per source.", [({"source": x["name"], "id": k}, round(x["total_ms"] / 1000, 3)) for k, x in src])
+
+    hosts = httpclient.host_stats()
+    _metric(out, "http_host_requests_total", "counter", "HTTP requests per host.", [({"host": h}, x["requests"]) for h, x in sorted(hosts.items())])
+    _metric(out, "http_host_errors_total", "counter", "HTTP errors (connection or 5xx) per host.", [({"host": h}, x["failures"]) for h, x in sorted(hosts.items())])
+    _metric(out, "http_host_seconds_total", "counter", "HTTP request time per host.", [({"host": h}, round(x["total_ms"] / 1000, 3)) for h, x in sorted(hosts.items())])
+
+    for k, v in sorted((extra_gauges or {}).items()):
+        _metric(out, k, "gauge", k.replace("_", " ").capitalize() + ".", [({}, v)])
+    return "\n".join(out) + "\n"
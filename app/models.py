@@ -1,6 +1,8 @@
+import os
+from array import array
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List
+from typing import List, Dict, Iterator
 
 
 @dataclass
@@ -17,6 +19,7 @@ class Rule:
 @dataclass
 class Settings:
     max_scan_files: int = 200000
+    scan_workers: int = 4
     video_exts: List[str] = field(default_factory=lambda: [".mkv", ".mp4", ".avi", ".ts", ".m2ts"])
 
 
@@ -30,3 +33,151 @@ class AppConfig:
 class MediaFile:
     path: Path
     stem: str
+
+    @property
+    def name(self) -> str:
+        return self.path.name
+
+    @property
+    def suffix(self) -> str:
+        return self.path.suffix
+
+    @property
+    def parent_name(self) -> str:
+        return self.path.parent.name
+
+    @property
+    def fspath(self) -> str:
+        return str(self.path)
+
+
+# 百万级文件库的紧凑表示：父目录去重成表，文件名和 stem 以 UTF-8 依次拼进同一个缓冲区，
+# 每个文件只占一个目录号和两个偏移量；file i 的名字是 buf[off[2i]:off[2i+1]]，stem 紧随其后
+class MediaLibrary:
+    def __init__(self):
+        self.dirs: List[str] = []
+        self._dir_ids: Dict[str, int] = {}
+        self._dir_names: List[str] = []
+        self._dir_of = array("I")
+        self._off = array("Q", [0])
+        self._buf = bytearray()
+        self._groups = None
+
+    def append(self, fspath: str, stem: str):
+        parent, _, name = fspath.rpartition(os.sep)
+        d = self._dir_ids.get(parent)
+        if d is None:
+            d = len(self.dirs)
+            self._dir_ids[parent] = d
+            self.dirs.append(parent)
+            self._dir_names.append(os.path.basename(parent))
+        self._dir_of.append(d)
+        self._buf += name.encode("utf-8")
+        self._off.append(len(self._buf))
+        self._buf += stem.encode("utf-8")
+        self._off.append(len(self._buf))
+        self._groups = None
+
+    def __len__(self) -> int:
+        return len(self._dir_of)
+
+    def __getitem__(self, i: int) -> "MediaFileView":
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return MediaFileView(self, i)
+
+    def __iter__(self) -> Iterator["MediaFileView"]:
+        for i in range(len(self)):
+            yield MediaFileView(self, i)
+
+    def name_at(self, i: int) -> str:
+        return self._buf[self._off[2 * i]:self._off[2 * i + 1]].decode("utf-8")
+
+    def stem_at(self, i: int) -> str:
+        return self._buf[self._off[2 * i + 1]:self._off[2 * i + 2]].decode("utf-8")
+
+    def iter_stems(self) -> Iterator[str]:
+        buf, off = self._buf, self._off
+        for i in range(len(self)):
+            yield buf[off[2 * i + 1]:off[2 * i + 2]].decode("utf-8")
+
+    def parent_at(self, i: int) -> str:
+        return self.dirs[self._dir_of[i]]
+
+    def parent_name_at(self, i: int) -> str:
+        return self._dir_names[self._dir_of[i]]
+
+    def fspath_at(self, i: int) -> str:
+        return self.dirs[self._dir_of[i]] + os.sep + self.name_at(i)
+
+    def find(self, fspath: str) -> int | None:
+        parent, _, name = fspath.rpartition(os.sep)
+        d = self._dir_ids.get(parent)
+        if d is None:
+            return None
+        if self._groups is None:
+            self._build_groups()
+        start, order = self._groups
+        for k in range(start[d], start[d + 1]):
+            if self.name_at(order[k]) == name:
+                return order[k]
+        return None
+
+    def _build_groups(self):
+        # 按目录号做一次计数排序，find 只需比对同目录下的文件名
+        start = array("I", [0]) * (len(self.dirs) + 1)
+        for d in self._dir_of:
+            start[d + 1] += 1
+        for d in range(len(self.dirs)):
+            start[d + 1] += start[d]
+        fill = start[:-1]
+        order = array("I", [0]) * len(self)
+        for i, d in enumerate(self._dir_of):
+            order[fill[d]] = i
+            fill[d] += 1
+        self._groups = (start, order)
+
+
+class MediaFileView:
+    __slots__ = ("lib", "i")
+
+    def __init__(self, lib: MediaLibrary, i: int):
+        self.lib = lib
+        self.i = i
+
+    @property
+    def stem(self) -> str:
+        return self.lib.stem_at(self.i)
+
+    @property
+    def name(self) -> str:
+        return self.lib.name_at(self.i)
+
+    @property
+    def suffix(self) -> str:
+        name = self.name
+        dot = name.rfind(".")
+        return name[dot:] if dot > 0 else ""
+
+    @property
+    def parent_name(self) -> str:
+        return self.lib.parent_name_at(self.i)
+
+    @property
+    def fspath(self) -> str:
+        return self.lib.fspath_at(self.i)
+
+    @property
+    def path(self) -> Path:
+        return Path(self.fspath)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, MediaFileView) and other.lib is self.lib and other.i == self.i
+
+    def __hash__(self) -> int:
+        return hash((id(self.lib), self.i))
+
+    def __repr__(self) -> str:
+        return f"MediaFileView({self.fspath!r})"
@@ -1,9 +1,16 @@
 from typing import List, Dict, Any
 from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor, wait
 import os
-import requests
+import json
+import math
+import time
+import threading
 import feedparser
 
+from . import httpclient
+from .db import save_source_feed_cache, get_source_cache, put_source_cache, get_setting
+
 
 def _dedupe(titles: List[str]) -> List[str]:
     seen = set()
@@ -27,20 +34,103 @@ def _parse_params(s: str) -> Dict[str, str]:
     return {k: v[0] for k, v in raw.items() if v}
 
 
-def fetch_rss_titles(urls: List[str]) -> List[str]:
-    titles: List[str] = []
-    for u in urls:
+class SourceFetchError(Exception):
+    pass
+
+
+def _json(r) -> Any:
+    if not r.ok:
+        raise SourceFetchError(f"HTTP {r.status_code}")
+    try:
+        return r.json()
+    except ValueError as e:
+        raise SourceFetchError(f"bad json: {e}")
+
+
+# 各榜单服务的分页并发上限（跨来源共享），避免同时打爆同一个 API
+_PROVIDER_CONCURRENCY = {"tmdb": 4, "justwatch": 2}
+_provider_slots = {k: threading.BoundedSemaphore(v) for k, v in _PROVIDER_CONCURRENCY.items()}
+
+
+def _fetch_ranked_pages(provider: str, fetch_page, extract, limit: int, per_page: int) -> List[str]:
+    # 先取第 1 页拿到 total_pages，再并发取剩余所需页；按页码顺序合并，够 limit 即停
+    limit = max(1, limit)
+    slots = _provider_slots[provider]
+    with slots:
+        first = fetch_page(1)
+    need = math.ceil(limit / per_page)
+    total = _to_int(first.get("total_pages"), need) or need
+    pages = {1: extract(first)}
+
+    def one(n: int):
         try:
-            d = feedparser.parse(u)
-            for e in d.entries:
-                t = (e.get("title") or "").strip()
-                if t:
-                    titles.append(t)
+            with slots:
+                return n, extract(fetch_page(n))
         except Exception:
-            continue
+            return n, None
+
+    rest = list(range(2, min(need, total) + 1))
+    if rest:
+        with ThreadPoolExecutor(max_workers=min(len(rest), _PROVIDER_CONCURRENCY[provider])) as pool:
+            for n, items in pool.map(one, rest):
+                pages[n] = items
+
+    out = []
+    for n in sorted(pages):
+        # 中间某页失败时只保留它之前的页，保证排名连续
+        if pages[n] is None:
+            break
+        out.extend(pages[n])
+        if len(_dedupe(out)) >= limit:
+            break
+    return _dedupe(out)[:limit]
+
+
+def _parse_feed_titles(d) -> List[str]:
+    titles = []
+    for e in d.entries:
+        t = (e.get("title") or "").strip()
+        if t:
+            titles.append(t)
     return _dedupe(titles)
 
 
+def fetch_rss_source(source: Dict[str, Any]) -> List[str]:
+    url = (source.get("rss_url") or "").strip()
+    if not url:
+        return []
+
+    cached = None
+    try:
+        cached = json.loads(source["cached_titles"]) if source.get("cached_titles") else None
+    except ValueError:
+        cached = None
+
+    # 只有本地有缓存标题时才带条件头，否则 304 无内容可复用
+    headers = {}
+    if cached is not None:
+        if source.get("http_etag"):
+            headers["If-None-Match"] = source["http_etag"]
+        if source.get("http_last_modified"):
+            headers["If-Modified-Since"] = source["http_last_modified"]
+    try:
+        r = httpclient.get(url, headers=headers)
+    except Exception as e:
+        raise SourceFetchError(str(e))
+
+    if r.status_code == 304 and cached is not None:
+        return cached
+    if not r.ok:
+        raise SourceFetchError(f"HTTP {r.status_code}")
+
+    titles = _parse_feed_titles(feedparser.parse(r.content))
+    etag = r.headers.get("ETag", "")
+    modified = r.headers.get("Last-Modified", "")
+    if source.get("id") is not None and (etag or modified):
+        save_source_feed_cache(source["id"], etag, modified, json.dumps(titles, ensure_ascii=False))
+    return titles
+
+
 def fetch_tmdb_titles(param_text: str) -> List[str]:
     api_key = os.getenv("TMDB_API_KEY", "").strip()
     if not api_key:
@@ -59,24 +149,27 @@ def fetch_tmdb_titles(param_text: str) -> List[str]:
         "sort_by": sort_by,
         "watch_region": region,
         "include_adult": "false",
-        "page": 1,
     }
     if provider:
         q["with_watch_providers"] = provider
 
-    try:
-        r = requests.get(url, params=q, timeout=20)
-        if not r.ok:
-            return []
-        data = r.json()
+    def fetch_page(page: int):
+        try:
+            r = httpclient.get(url, params={**q, "page": page})
+        except Exception as e:
+            raise SourceFetchError(str(e))
+        return _json(r)
+
+    def extract(data) -> List[str]:
         out = []
-        for x in data.get("results", [])[:limit]:
+        for x in data.get("results", []):
             t = (x.get("title") or x.get("name") or "").strip()
             if t:
                 out.append(t)
-        return _dedupe(out)
-    except Exception:
-        return []
+        return out
+
+    # TMDB discover 固定每页 20 条，最多 500 页
+    return _fetch_ranked_pages("tmdb", fetch_page, extract, min(limit, 20 * 500), 20)
 
 
 def fetch_trakt_titles(param_text: str) -> List[str]:
@@ -102,19 +195,17 @@ def fetch_trakt_titles(param_text: str) -> List[str]:
     }
 
     try:
-        r = requests.get(url, headers=headers, params={"limit": limit}, timeout=20)
-        if not r.ok:
-            return []
-        arr = r.json()
-        out = []
-        for item in arr:
-            obj = item.get("show") if kind == "shows" else item.get("movie")
-            t = (obj or {}).get("title", "").strip()
-            if t:
-                out.append(t)
-        return _dedupe(out)
-    except Exception:
-        return []
+        r = httpclient.get(url, headers=headers, params={"limit": limit})
+    except Exception as e:
+        raise SourceFetchError(str(e))
+    arr = _json(r)
+    out = []
+    for item in arr:
+        obj = item.get("show") if kind == "shows" else item.get("movie")
+        t = (obj or {}).get("title", "").strip()
+        if t:
+            out.append(t)
+    return _dedupe(out)
 
 
 def fetch_justwatch_titles(param_text: str) -> List[str]:
@@ -130,9 +221,9 @@ def fetch_justwatch_titles(param_text: str) -> List[str]:
     if mode == "latest":
         sort_by = "release_date"
 
+    page_size = min(max(limit, 1), 100)
     body = {
-        "page_size": min(max(limit, 1), 100),
-        "page": 1,
+        "page_size": page_size,
         "query": "",
         "content_types": [content],
         "providers": [provider],
@@ -141,30 +232,60 @@ def fetch_justwatch_titles(param_text: str) -> List[str]:
     }
     url = f"https://apis.justwatch.com/content/titles/{country}/popular"
 
-    try:
-        r = requests.post(url, json=body, timeout=20)
-        if not r.ok:
-            return []
-        data = r.json()
+    def fetch_page(page: int):
+        try:
+            r = httpclient.post(url, json={**body, "page": page})
+        except Exception as e:
+            raise SourceFetchError(str(e))
+        return _json(r)
+
+    def extract(data) -> List[str]:
         out = []
-        for x in data.get("items", [])[:limit]:
+        for x in data.get("items", []):
             t = (x.get("title") or x.get("original_title") or "").strip()
             if t:
                 out.append(t)
-        return _dedupe(out)
-    except Exception:
-        return []
+        return out
 
+    return _fetch_ranked_pages("justwatch", fetch_page, extract, limit, page_size)
 
-def fetch_source_titles(source: Dict[str, Any]) -> List[str]:
-    if not int(source.get("enabled", 1)):
-        return []
 
-    kind = (source.get("kind") or "rss").lower()
-    cfg = (source.get("rss_url") or "").strip()
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+_source_stats: Dict[int, Dict[str, Any]] = {}
+_source_stats_lock = threading.Lock()
+
+
+def _record_source(source: Dict[str, Any], elapsed_ms: float | None, error: str | None = None, cache_hit: bool = False):
+    with _source_stats_lock:
+        x = _source_stats.setdefault(
+            source.get("id"),
+            {"name": "", "requests": 0, "failures": 0, "cache_hits": 0, "total_ms": 0.0, "last_ms": 0.0, "last_error": ""},
+        )
+        x["name"] = source.get("name") or ""
+        if cache_hit:
+            x["cache_hits"] += 1
+            return
+        x["requests"] += 1
+        x["total_ms"] += elapsed_ms or 0.0
+        x["last_ms"] = elapsed_ms or 0.0
+        if error:
+            x["failures"] += 1
+            x["last_error"] = error[:200]
+
 
+def source_stats() -> Dict[int, Dict[str, Any]]:
+    with _source_stats_lock:
+        out = {k: dict(v) for k, v in _source_stats.items()}
+    for x in out.values():
+        x["avg_ms"] = round(x["total_ms"] / x["requests"], 1) if x["requests"] else 0.0
+    return out
+
+
+def _fetch_uncached(source: Dict[str, Any], kind: str, cfg: str) -> List[str]:
     if kind == "rss":
-        return fetch_rss_titles([cfg]) if cfg else []
+        return fetch_rss_source(source) if cfg else []
     if kind == "tmdb":
         return fetch_tmdb_titles(cfg)
     if kind == "trakt":
@@ -173,3 +294,97 @@ def fetch_source_titles(source: Dict[str, Any]) -> List[str]:
         return fetch_justwatch_titles(cfg)
 
     return []
+
+
+def _fetch_and_store(source: Dict[str, Any], kind: str, cfg: str) -> List[str]:
+    start = time.monotonic()
+    try:
+        titles = _fetch_uncached(source, kind, cfg)
+    except Exception as e:
+        _record_source(source, (time.monotonic() - start) * 1000, str(e) or e.__class__.__name__)
+        raise
+    _record_source(source, (time.monotonic() - start) * 1000)
+    # 空结果多半是临时失败，不写缓存，避免把一次失败缓存成一整个 TTL
+    if titles:
+        put_source_cache(kind, cfg, json.dumps(titles, ensure_ascii=False), time.time())
+    return titles
+
+
+def _revalidate(source: Dict[str, Any], kind: str, cfg: str):
+    key = (kind, cfg)
+    with _revalidating_lock:
+        if key in _revalidating:
+            return
+        _revalidating.add(key)
+
+    def work():
+        try:
+            _fetch_and_store(source, kind, cfg)
+        except Exception:
+            pass
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(key)
+
+    threading.Thread(target=work, daemon=True).start()
+
+
+def fetch_source_titles(source: Dict[str, Any], force: bool = False, allow_stale: bool = True) -> List[str]:
+    if not int(source.get("enabled", 1)):
+        return []
+
+    kind = (source.get("kind") or "rss").lower()
+    cfg = (source.get("rss_url") or "").strip()
+    if kind not in {"rss", "tmdb", "trakt", "justwatch"}:
+        return []
+
+    hit = get_source_cache(kind, cfg)
+    if hit and not force:
+        ttl = _to_int(get_setting("source_cache_ttl", "1800"), 1800)
+        stale = _to_int(get_setting("source_cache_stale", "86400"), 86400)
+        age = time.time() - hit["fetched_at"]
+        # allow_stale=False（正式运行）：过了 TTL 就同步重新抓取，只在抓取失败时才退回旧数据，
+        # 否则定时运行拿到的永远是上一轮的标题；预览和来源测试仍走 stale-while-revalidate
+        if age < (ttl + stale if allow_stale else ttl):
+            # 过期但仍在 stale 窗口内：先返回旧数据，后台刷新
+            if age >= ttl:
+                _revalidate(source, kind, cfg)
+            _record_source(source, None, cache_hit=True)
+            return json.loads(hit["titles"])
+
+    try:
+        return _fetch_and_store(source, kind, cfg)
+    except Exception:
+        # 抓取失败时退回上一次成功的结果，避免一次网络抖动清空整个虚拟库
+        return json.loads(hit["titles"]) if hit else []
+
+
+def fetch_sources_titles(
+    sources: List[Dict[str, Any]], workers: int = 8, deadline: float = 300, allow_stale: bool = True
+) -> Dict[int, List[str]]:
+    # 同一来源只抓一次，多来源并发抓取；超过 deadline 仍未返回的来源改用上次缓存的标题，
+    # 没有缓存时才不出现在结果里
+    uniq = {}
+    for s in sources:
+        uniq.setdefault(s["id"], s)
+    if not uniq:
+        return {}
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(workers, len(uniq))))
+    futs = {pool.submit(fetch_source_titles, s, False, allow_stale): sid for sid, s in uniq.items()}
+    done, _ = wait(futs, timeout=max(1, deadline))
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    out = {}
+    for f, sid in futs.items():
+        if f in done:
+            try:
+                out[sid] = f.result()
+            except Exception:
+                out[sid] = []
+            continue
+        s = uniq[sid]
+        hit = get_source_cache((s.get("kind") or "rss").lower(), (s.get("rss_url") or "").strip())
+        if hit:
+            out[sid] = json.loads(hit["titles"])
+    return out
@@ -0,0 +1,241 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+from typing import Callable, List
+
+from .library import refresh_media_dirs, refresh_media_index
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# 这些文件系统上 inotify 收不到其他主机的改动，auto 模式直接改用轮询
+_REMOTE_FS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "fuse.sshfs", "fuse.rclone", "9p", "fuse.mergerfs", "fuse.glusterfs", "ceph", "davfs"}
+
+_WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+_EVENT = struct.Struct("iIII")
+
+
+def _fs_type(path: str) -> str:
+    # 取 /proc/mounts 里挂载点最长匹配的那一项
+    path = os.path.realpath(path)
+    best, fstype = "", ""
+    try:
+        with open("/proc/mounts", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mnt = parts[1].replace("\\040", " ")
+                if (path == mnt or path.startswith(mnt.rstrip("/") + "/")) and len(mnt) > len(best):
+                    best, fstype = mnt, parts[2]
+    except OSError:
+        return ""
+    return fstype
+
+
+class _Inotify:
+    def __init__(self):
+        name = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(name or None, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify not available")
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.paths = {}
+        self.wds = {}
+
+    def add(self, path: str) -> bool:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e == errno.ENOSPC:
+                raise OSError(e, "inotify watch limit reached (fs.inotify.max_user_watches)")
+            return False
+        self.paths[wd] = path
+        self.wds[path] = wd
+        return True
+
+    def add_tree(self, top: str):
+        # 已有 watch 的目录只跳过 add，仍然往下走，新建或停机期间出现的子目录才能补上
+        stack = [top]
+        while stack:
+            d = stack.pop()
+            if d not in self.wds and not self.add(d):
+                continue
+            try:
+                with os.scandir(d) as it:
+                    stack.extend(e.path for e in it if e.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+    def forget(self, wd: int):
+        path = self.paths.pop(wd, None)
+        if path is not None and self.wds.get(path) == wd:
+            del self.wds[path]
+
+    def read(self) -> List[tuple]:
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        out = []
+        off = 0
+        while off + _EVENT.size <= len(buf):
+            wd, mask, _cookie, size = _EVENT.unpack_from(buf, off)
+            name = buf[off + _EVENT.size:off + _EVENT.size + size].rstrip(b"\0")
+            off += _EVENT.size + size
+            out.append((wd, mask, os.fsdecode(name)))
+        return out
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+# 监听 MEDIA_ROOT 的目录变化并增量更新媒体索引。
+# inotify 可用时按目录收集事件，安静 debounce 秒后只重扫变化的目录；
+# 不可用（非 Linux、watch 数超限）或 MEDIA_ROOT 在网络文件系统上（按 /proc/mounts 判断）时
+# 退回按 poll_interval 定期做一次 mtime 增量刷新。
+class MediaWatcher:
+    def __init__(self):
+        self.on_change: Callable[[dict], None] | None = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._args = None
+        self.status = {"mode": "off", "watched_dirs": 0, "last_event": None, "last_update": None, "updates": 0, "error": ""}
+
+    def start(self, media_root: str, exts: List[str], mode: str = "auto", debounce: float = 60, poll_interval: float = 300, max_scan: int = 0):
+        args = (media_root, list(exts), mode, max(1.0, float(debounce)), max(10.0, float(poll_interval)), max(0, int(max_scan)))
+        with self._lock:
+            # 配置没变且线程还在时不重启，避免保存设置就重新挂一遍 watch
+            if args == self._args and self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_locked()
+            self._args = args
+            self.status.update(mode="off", watched_dirs=0, error="")
+            if mode not in {"auto", "poll"} or not os.path.isdir(media_root):
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=args + (self._stop,), name="media-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stop_locked()
+            self._args = None
+            self.status["mode"] = "off"
+
+    def _stop_locked(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self, root, exts, mode, debounce, poll_interval, max_scan, stop):
+        fstype = _fs_type(root) if mode == "auto" else ""
+        if fstype in _REMOTE_FS:
+            self.status["error"] = f"{fstype} does not deliver remote inotify events, polling"
+        elif mode == "auto":
+            try:
+                self._run_inotify(root, exts, debounce, max_scan, stop)
+                return
+            except OSError as e:
+                self.status["error"] = str(e)
+        if not stop.is_set():
+            self._run_poll(root, exts, poll_interval, max_scan, stop)
+
+    def _run_inotify(self, root, exts, debounce, max_scan, stop):
+        ino = _Inotify()
+        try:
+            # 整棵树都要走一遍：索引里没有的目录（停机期间新建、之后由全量刷新才收录的）也得挂上 watch
+            ino.add_tree(root)
+            self.status.update(mode="inotify", watched_dirs=len(ino.wds))
+
+            dirty = set()
+            overflow = False
+            last = 0.0
+            while not stop.is_set():
+                ready, _, _ = select.select([ino.fd], [], [], 1.0)
+                if ready:
+                    for wd, mask, name in ino.read():
+                        if mask & IN_Q_OVERFLOW:
+                            overflow = True
+                            continue
+                        path = ino.paths.get(wd)
+                        if path is None:
+                            continue
+                        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                            dirty.add(os.path.dirname(path))
+                        elif mask & IN_IGNORED:
+                            ino.forget(wd)
+                            continue
+                        else:
+                            dirty.add(path)
+                        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                            ino.add_tree(os.path.join(path, name))
+                        if mask & IN_ISDIR and mask & (IN_DELETE | IN_MOVED_FROM):
+                            gone = ino.wds.get(os.path.join(path, name))
+                            if gone is not None:
+                                ino.forget(gone)
+                    last = time.monotonic()
+                    self.status.update(last_event=time.strftime("%Y-%m-%d %H:%M:%S"), watched_dirs=len(ino.wds))
+                if (dirty or overflow) and time.monotonic() - last >= debounce:
+                    # 事件队列溢出时丢失了部分目录，退回一次 mtime 增量刷新
+                    try:
+                        stats = None if overflow else refresh_media_dirs(root, exts, sorted(dirty), max_scan)
+                        if stats is None:
+                            stats = refresh_media_index(root, exts, max_scan=max_scan)
+                    except Exception as e:
+                        self.status["error"] = str(e)
+                        stats = None
+                    dirty = set()
+                    overflow = False
+                    if stats is not None:
+                        self._changed(stats)
+        finally:
+            ino.close()
+
+    def _run_poll(self, root, exts, poll_interval, max_scan, stop):
+        self.status.update(mode="poll", watched_dirs=0)
+        while not stop.wait(poll_interval):
+            try:
+                stats = refresh_media_index(root, exts, max_scan=max_scan)
+            except Exception as e:
+                self.status["error"] = str(e)
+                continue
+            self._changed(stats)
+
+    def _changed(self, stats: dict):
+        if not stats["files_added"] and not stats["files_removed"]:
+            return
+        self.status["last_update"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.status["updates"] += 1
+        if self.on_change is not None:
+            try:
+                self.on_change(stats)
+            except Exception as e:
+                self.status["error"] = str(e)
+
+
+media_watcher = MediaWatcher()
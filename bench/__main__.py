@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .synth import build_tree, make_aliases, make_titles, rss_feed
+
+EXTS = [".mkv", ".mp4", ".avi", ".ts", ".m2ts", ".strm"]
+
+
+def _timed(out: dict, name: str, fn, *args, **kwargs):
+    t = time.perf_counter()
+    r = fn(*args, **kwargs)
+    out[name] = round(time.perf_counter() - t, 4)
+    return r
+
+
+def _feed_server(feeds: dict):
+    class H(BaseHTTPRequestHandler):
+        def log_message(self, *a):
+            pass
+
+        def do_GET(self):
+            body = feeds.get(self.path.lstrip("/"))
+            self.send_response(200 if body is not None else 404)
+            self.send_header("Content-Type", "application/rss+xml")
+            self.send_header("Content-Length", str(len(body or b"")))
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), H)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def _use_db(path: str):
+    from app import db
+
+    db.DB_PATH = path
+    db.init_db()
+    return db
+
+
+def bench_size(n: int, args, work: str) -> dict:
+    from app import main
+    from app.generator import rebuild_rule_dir
+    from app.library import (
+        MatchCache,
+        StemIndex,
+        compile_alias_map,
+        load_indexed_files,
+        match_rules_to_files,
+        media_index_generation,
+        refresh_media_index,
+        scan_media_files,
+    )
+
+    media = os.path.join(work, "media")
+    res = {"files": n, "timings": {}, "counts": {}}
+    t = res["timings"]
+    series = _timed(t, "generate", build_tree, media, n, args.depth, args.per_series, args.cjk, args.strm, args.seed)
+    titles = make_titles(series, args.rules, args.titles, args.hit_ratio, args.seed)
+    aliases = make_aliases(series, args.aliases)
+    alias_map = compile_alias_map(aliases)
+    jobs = [{"titles": ts, "include_keywords": [], "exclude_keywords": [], "limit": args.max_items} for ts in titles]
+    res["counts"].update(series=len(series), titles=sum(len(x) for x in titles), aliases=len(aliases))
+
+    # 扫描：旧的整树遍历，以及媒体索引的冷启动 / 无变化增量刷新
+    found = _timed(t, "scan_walk", scan_media_files, media, EXTS, n + 1, args.workers)
+    res["counts"]["scanned"] = len(found)
+    del found
+    _use_db(os.path.join(work, "index.db"))
+    _timed(t, "index_cold", refresh_media_index, media, EXTS, args.workers)
+    _timed(t, "index_warm", refresh_media_index, media, EXTS, args.workers)
+
+    # 匹配：首次（建倒排索引并写匹配缓存）和命中持久化缓存
+    files = _timed(t, "load_index", load_indexed_files, n, True)
+    gen = media_index_generation()
+
+    def match():
+        return match_rules_to_files(jobs, files, alias_map, StemIndex(files, MatchCache("bench", gen)))
+
+    matches = _timed(t, "match_cold", match)
+    _timed(t, "match_cached", match)
+    res["counts"]["matched"] = sum(len(m) for m in matches)
+
+    # 链接：空目录首次生成和无变化的增量同步
+    virtual = os.path.join(work, "virtual-link")
+
+    def link():
+        out = []
+        for i, m in enumerate(matches):
+            class _R:
+                name = f"bench-{i}"
+                target_subdir = f"bench-{i}"
+
+            out.append(rebuild_rule_dir(virtual, _R, m, mode=args.link_mode))
+        return out
+
+    linked = _timed(t, "link_cold", link)
+    _timed(t, "link_warm", link)
+    res["counts"]["linked"] = sum(r["linked"] for r in linked)
+
+    # 完整运行：新数据库（索引从零建起），来源走本地 HTTP 上的 RSS
+    feeds = {f"feed{i}": rss_feed(ts) for i, ts in enumerate(titles)}
+    srv = _feed_server(feeds)
+    try:
+        db = _use_db(os.path.join(work, "run.db"))
+        cfg = os.path.join(work, "rules.yaml")
+        with open(cfg, "w", encoding="utf-8") as f:
+            f.write(f"settings:\n  max_scan_files: {n}\n  scan_workers: {args.workers}\nrules: []\n")
+        os.environ["APP_CONFIG"] = cfg
+        main.MEDIA_ROOT = media
+        main.VIRTUAL_ROOT = os.path.join(work, "virtual-run")
+        os.makedirs(main.VIRTUAL_ROOT, exist_ok=True)
+        db.set_setting("max_scan_files", str(n))
+        db.set_setting("scan_workers", str(args.workers))
+        db.set_setting("video_exts", ",".join(EXTS))
+        db.set_setting("link_mode", args.link_mode)
+        db.set_setting("title_aliases", "\n".join(f"{k}={v}" for k, v in aliases.items()))
+        base = f"http://127.0.0.1:{srv.server_address[1]}"
+        for i in range(len(titles)):
+            db.create_source(f"bench-{i}", "rss", f"{base}/feed{i}", "")
+            db.create_rule(f"bench-{i}", f"bench-{i}", str(i + 1), "", "", args.max_items)
+        _timed(t, "run_once_cold", main.run_once)
+        _timed(t, "run_once_warm", main.run_once)
+        runs = db.list_runs(2)
+        res["run_phases"] = {r["id"]: json.loads(r["metrics"] or "{}").get("phases", {}) for r in runs}
+    finally:
+        srv.shutdown()
+    res["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return res
+
+
+def main():
+    p = argparse.ArgumentParser(prog="python -m bench", description="Benchmark scan / match / link / run_once on a synthetic media tree.")
+    p.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated file counts")
+    p.add_argument("--depth", type=int, default=2, choices=[1, 2, 3])
+    p.add_argument("--per-series", type=int, default=24, help="files per series")
+    p.add_argument("--cjk", type=float, default=0.5, help="fraction of series with CJK names")
+    p.add_argument("--strm", type=float, default=0.2, help="fraction of series stored as .strm")
+    p.add_argument("--rules", type=int, default=10)
+    p.add_argument("--titles", type=int, default=200, help="titles per rule")
+    p.add_argument("--hit-ratio", type=float, default=0.7, help="fraction of titles present in the library")
+    p.add_argument("--aliases", type=int, default=2000, help="max alias entries")
+    p.add_argument("--max-items", type=int, default=100)
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--link-mode", default="reconcile", choices=["reconcile", "atomic", "rebuild"])
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--tmp", default=None, help="where to build the tree (defaults to the system temp dir)")
+    p.add_argument("--keep", action="store_true", help="keep generated trees")
+    p.add_argument("--out", default="-", help="JSON output file, - for stdout")
+    args = p.parse_args()
+
+    report = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "params": {k: v for k, v in vars(args).items() if k not in {"out", "tmp", "keep"}},
+        "results": [],
+    }
+    for n in [int(x) for x in args.sizes.split(",") if x.strip()]:
+        work = tempfile.mkdtemp(prefix=f"bench-{n}-", dir=args.tmp)
+        try:
+            report["results"].append(bench_size(n, args, work))
+        finally:
+            if not args.keep:
+                shutil.rmtree(work, ignore_errors=True)
+        print(f"bench: {n} files done", file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out == "-":
+        print(text)
+    else:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
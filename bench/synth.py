@@ -0,0 +1,120 @@
+import os
+import random
+import zlib
+from typing import Dict, List
+
+# 合成媒体库：固定 seed 下每次生成的目录、文件名、标题和别名完全一致，方便跨版本对比
+
+_EN_ADJ = [
+    "Silent", "Broken", "Hidden", "Last", "Golden", "Crimson", "Endless", "Lost", "Wild", "Dark",
+    "Northern", "Burning", "Frozen", "Secret", "Little", "Iron", "Quiet", "Electric", "Paper", "Glass",
+]
+_EN_NOUN = [
+    "River", "Empire", "Kingdom", "Detective", "Harbor", "Garden", "Signal", "Frontier", "Witness", "Legacy",
+    "Station", "Island", "Orchard", "Circuit", "Winter", "Shadow", "Mirror", "Voyage", "Factory", "Crown",
+]
+_CJK = "山河长风明月江湖青春人间繁花天下少年故乡星辰秘密归来猎人医生律师警察都市烟火传奇庆余年家族大海白夜追凶漫长季节"
+_CATEGORIES = ["剧集", "电影", "动漫", "纪录片", "Series", "Movies"]
+_LOCAL_EXTS = [".mkv", ".mp4", ".ts"]
+
+
+def _en_name(rng: random.Random) -> str:
+    return f"The {rng.choice(_EN_ADJ)} {rng.choice(_EN_NOUN)}" if rng.random() < 0.3 else f"{rng.choice(_EN_ADJ)} {rng.choice(_EN_NOUN)}"
+
+
+def _cjk_name(rng: random.Random) -> str:
+    return "".join(rng.choice(_CJK) for _ in range(rng.randint(2, 5)))
+
+
+def make_series(count: int, cjk_ratio: float, seed: int) -> List[Dict[str, str]]:
+    # 每部剧：目录名（同名加年份区分）、中文名（CJK 剧才有）和英文名
+    rng = random.Random(seed)
+    seen = set()
+    out = []
+    while len(out) < count:
+        en = _en_name(rng)
+        cjk = _cjk_name(rng) if rng.random() < cjk_ratio else ""
+        name = cjk or en
+        if name in seen:
+            name = f"{name} ({rng.randint(1980, 2025)})"
+            if name in seen:
+                name = f"{name} {len(out)}"
+        seen.add(name)
+        out.append({"name": name, "cjk": cjk, "en": en})
+    return out
+
+
+def _episode_name(s: dict, season: int, ep: int, ext: str) -> str:
+    if s["cjk"]:
+        return f"{s['name']} S{season:02d}E{ep:02d}{ext}" if ep % 2 else f"{s['name']} 第{season}季 第{ep:02d}集{ext}"
+    return f"{s['name'].replace(' ', '.')}.S{season:02d}E{ep:02d}.1080p{ext}"
+
+
+def build_tree(
+    root: str,
+    files: int,
+    depth: int = 2,
+    per_series: int = 24,
+    cjk_ratio: float = 0.5,
+    strm_ratio: float = 0.2,
+    seed: int = 42,
+) -> List[Dict[str, str]]:
+    # depth 1: 剧名/文件；2: 剧名/Season N/文件；3: 分类/剧名/Season N/文件
+    rng = random.Random(seed + 1)
+    series = make_series(max(1, -(-files // per_series)), cjk_ratio, seed)
+    written = 0
+    for s in series:
+        base = os.path.join(root, _CATEGORIES[zlib.crc32(s["name"].encode()) % len(_CATEGORIES)] if depth >= 3 else "", s["name"])
+        # 整部剧要么是本地文件要么是 .strm，少数剧两种都有（用来覆盖本地优先的路径）
+        kind = "strm" if rng.random() < strm_ratio else "local"
+        both = rng.random() < 0.05
+        for i in range(per_series):
+            if written >= files:
+                break
+            season, ep = divmod(i, 12)
+            d = os.path.join(base, f"Season {season + 1}") if depth >= 2 else base
+            if i % 12 == 0:
+                os.makedirs(d, exist_ok=True)
+            ext = ".strm" if kind == "strm" else _LOCAL_EXTS[i % len(_LOCAL_EXTS)]
+            with open(os.path.join(d, _episode_name(s, season + 1, ep + 1, ext)), "wb") as f:
+                if ext == ".strm":
+                    f.write(f"http://media.invalid/{written}\n".encode())
+            written += 1
+            if both and ext != ".strm" and written < files:
+                open(os.path.join(d, _episode_name(s, season + 1, ep + 1, ".strm")), "wb").close()
+                written += 1
+        if written >= files:
+            break
+    return series
+
+
+def make_titles(series: List[Dict[str, str]], rules: int, per_rule: int, hit_ratio: float = 0.7, seed: int = 42) -> List[List[str]]:
+    # 命中的标题取自真实剧名（CJK 剧一半用英文名，靠别名命中），其余是库里没有的标题
+    rng = random.Random(seed + 2)
+    out = []
+    for _ in range(rules):
+        titles = []
+        for _ in range(per_rule):
+            if rng.random() < hit_ratio:
+                s = rng.choice(series)
+                titles.append(s["en"] if s["cjk"] and rng.random() < 0.5 else s["name"].split(" (")[0])
+            else:
+                titles.append(f"{_en_name(rng)} {rng.randint(1, 99999)}")
+        out.append(titles)
+    return out
+
+
+def make_aliases(series: List[Dict[str, str]], limit: int = 2000) -> Dict[str, str]:
+    out = {}
+    for s in series:
+        if s["cjk"] and s["en"] not in out:
+            out[s["en"]] = s["cjk"]
+            if len(out) >= limit:
+                break
+    return out
+
+
+def rss_feed(titles: List[str]) -> bytes:
+    esc = lambda t: t.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    items = "".join(f"<item><title>{esc(t)}</title></item>" for t in titles)
+    return f'<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel><title>bench</title>{items}</channel></rss>'.encode()